@@ -0,0 +1,192 @@
+"""
+Hash aggregation for CSVTable.group_by(). Rows are read once, and each group keeps one small state per aggregate.
+Partial states from partitions of a table can be merged, so partitions can be aggregated in parallel. The states
+are plain lists of numbers and values, which pickle cheaply when a worker process returns them.
+
+Aggregates are given as a dict of output column name to (function, column), e.g.
+{"total_H": ("sum", "H"), "players": ("count", None)}. count with column None counts rows. The other functions
+skip NULL values, and are None for a group without values.
+"""
+
+import operator
+
+functions = ("count", "sum", "min", "max", "avg")
+
+
+def _step_count(s, v):
+    return s if v is None else s + 1
+
+
+def _step_count_rows(s, v):
+    return s + 1
+
+
+def _step_sum(s, v):
+    if v is None:
+        return s
+    return v if s is None else s + v
+
+
+def _step_min(s, v):
+    if v is None or (s is not None and s <= v):
+        return s
+    return v
+
+
+def _step_max(s, v):
+    if v is None or (s is not None and s >= v):
+        return s
+    return v
+
+
+def _step_avg(s, v):
+    if v is None:
+        return s
+    return (s[0] + v, s[1] + 1)
+
+
+def _merge_count(a, b):
+    return a + b
+
+
+def _merge_sum(a, b):
+    return _step_sum(a, b)
+
+
+def _merge_avg(a, b):
+    return (a[0] + b[0], a[1] + b[1])
+
+
+# function: (initial state, step(state, value), merge(state, state), final(state))
+_functions = {
+    "count": (0, _step_count, _merge_count, None),
+    "count_rows": (0, _step_count_rows, _merge_count, None), # count with column None
+    "sum": (None, _step_sum, _merge_sum, None),
+    "min": (None, _step_min, _step_min, None),
+    "max": (None, _step_max, _step_max, None),
+    "avg": ((0, 0), _step_avg, _merge_avg, lambda s: s[0] / s[1] if s[1] else None)
+}
+
+
+def parse_aggregates(aggregates):
+    """
+    :param aggregates: dict of output column name to (function, column).
+    :return: (list of output names, list of functions, list of columns). count with column None is returned as
+        the function count_rows, whose input values are ignored. Raises ValueError for an unknown function, or a
+        missing column for a function other than count.
+    """
+    names, fns, columns = [], [], []
+    for name, spec in aggregates.items():
+        try:
+            fn, column = spec
+        except (TypeError, ValueError):
+            raise ValueError("Aggregate " + str(name) + " must be a (function, column) pair")
+        fn = str(fn).lower()
+        if fn not in functions:
+            raise ValueError("Invalid aggregate function = " + str(fn))
+        if column is None:
+            if fn != "count":
+                raise ValueError("Aggregate function " + fn + " needs a column")
+            fn = "count_rows"
+        names.append(name)
+        fns.append(fn)
+        columns.append(column)
+    return names, fns, columns
+
+
+def aggregate_values(fns, key_count, values):
+    """
+    Aggregate a partition. Runs in a worker process for parallel aggregation.
+    :param fns: List of aggregate functions.
+    :param key_count: Number of grouping columns.
+    :param values: Iterable of sequences, each holding the grouping values and then one input value per
+        function.
+    :return: dict of group key to list of partial states. The key is the single grouping value, a tuple of them
+        for several grouping columns, or () for none.
+    """
+    initial = [_functions[fn][0] for fn in fns]
+    steps = list(enumerate(_functions[fn][1] for fn in fns))
+    if key_count == 0:
+        key_of = lambda v: ()
+    elif key_count == 1:
+        key_of = operator.itemgetter(0)
+    else:
+        key_of = operator.itemgetter(*range(key_count))
+
+    groups = {}
+    for v in values:
+        k = key_of(v)
+        state = groups.get(k)
+        if state is None:
+            state = groups[k] = list(initial)
+        for i, step in steps:
+            state[i] = step(state[i], v[key_count + i])
+    return groups
+
+
+def aggregate_columns(fns, key_count, columns):
+    """
+    Aggregate a partition of a table held column by column, e.g. the slices from ColumnStore.take() that group_by()
+    sends to each worker. The partial states it returns are merged with merge().
+    :param fns: List of aggregate functions.
+    :param key_count: Number of grouping columns.
+    :param columns: List of columns, the grouping columns and then one input column per function, holding the
+        values of the same rows.
+    :return: See aggregate_values().
+    """
+    return aggregate_values(fns, key_count, zip(*columns))
+
+
+def merge(fns, groups, partial):
+    """
+    Merge the partial states of another partition into groups.
+    :return: groups
+    """
+    merges = list(enumerate(_functions[fn][2] for fn in fns))
+    for k, state in partial.items():
+        current = groups.get(k)
+        if current is None:
+            groups[k] = state
+            continue
+        for i, merge_state in merges:
+            current[i] = merge_state(current[i], state[i])
+    return groups
+
+
+def results(names, fns, keys, groups):
+    """
+    :param names: Output names of the aggregates.
+    :param fns: Aggregate functions.
+    :param keys: Grouping columns.
+    :param groups: dict of group key to states, from aggregate_values() or merge().
+    :return: List of dicts, one per group, holding the grouping columns and the aggregates. Without grouping
+        columns, there is one row even if there were no input rows, as in SQL.
+    """
+    if not keys and not groups:
+        groups = {(): [_functions[fn][0] for fn in fns]}
+    finals = [_functions[fn][3] for fn in fns]
+    result = []
+    for k, state in groups.items():
+        if len(keys) == 1:
+            row = {keys[0]: k}
+        else:
+            row = dict(zip(keys, k))
+        for name, final, s in zip(names, finals, state):
+            row[name] = final(s) if final is not None else s
+        result.append(row)
+    return result
+
+
+def group_rows(rows, keys, aggregates):
+    """
+    Aggregate any iterable of rows in one pass, e.g. the rows streamed by CSVTable.join_iter(), without keeping
+    them.
+    :param rows: Iterable of dicts.
+    :param keys: List of grouping columns.
+    :param aggregates: dict of output column name to (function, column).
+    :return: List of dicts, one per group.
+    """
+    names, fns, columns = parse_aggregates(aggregates)
+    fields = list(keys) + columns
+    values = ([None if f is None else r[f] for f in fields] for r in rows)
+    return results(names, fns, list(keys), aggregate_values(fns, len(keys), values))
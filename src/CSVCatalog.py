@@ -1,9 +1,30 @@
-import pymysql
+import CSVCatalogBackend
+import CSVStatistics
+import contextlib
 import csv
 import logging
+import threading
 import json
 
 
+def parse_index_columns(columns):
+    """
+    :param columns: The columns of an index as stored in IndexDefinitions. This is a JSON list. Catalogs written
+        by older versions hold a quoted, comma separated string, e.g. "'nameLast, nameFirst'".
+    :return: List of column names.
+    """
+    try:
+        result = json.loads(columns)
+        if isinstance(result, list):
+            return [str(c) for c in result]
+    except ValueError:
+        pass
+    columns = columns.strip()
+    if len(columns) >= 2 and columns[0] == columns[-1] and columns[0] in "'\"":
+        columns = columns[1:-1]
+    return [c.strip() for c in columns.split(",") if c.strip()]
+
+
 class ColumnDefinition:
     """
     Represents a column definition in the CSV Catalog.
@@ -42,7 +63,9 @@ class IndexDefinition:
     """
     Represents the definition of an index.
     """
-    index_types = ("PRIMARY", "UNIQUE", "INDEX")
+    # SORTED indexes keep their keys in order and support range predicates. Their columns must be "number" columns.
+    # BITMAP indexes are for columns with few distinct values, e.g. throws or birthCountry.
+    index_types = ("PRIMARY", "UNIQUE", "INDEX", "SORTED", "BITMAP")
 
     def __init__(self, index_name, index_type):
         """
@@ -64,7 +87,8 @@ class TableDefinition:
         :param column_definitions: List of column definitions to use from file. Cannot contain invalid column name.
             May be just a subset of the columns.
         :param index_definitions: List of index definitions. Column names must be valid.
-        :param cnx: Database connection to use. If None, create a default connection.
+        :param cnx: Database connection to use. If None, a connection is borrowed from the catalog's pool for each
+            operation.
         """
         self.json_data = dict()
         self.t_name = t_name
@@ -72,17 +96,23 @@ class TableDefinition:
         self.column_definitions = column_definitions
         self.index_definitions = index_definitions
         self.cnx = cnx 
+        self.catalog = None # CSVCatalog caching this definition, told about changes to it.
+        self.__csv_header__ = None # Column names in the CSV file, read on first use.
+        self.__column_types__ = None # {column name: column type} of the defined columns, loaded on first use.
+        self.__statistics__ = None # {column name: statistics} saved by CSVTable.analyze(), loaded on first use.
 
         #self.columns = []
 
         if t_name and csv_f:
             insert_table_definition = "INSERT INTO TableDefinitions(table_name, file_name) VALUES(%s, %s)"
             try:
-                with self.cnx.cursor() as cursor:
+                with self.__connection__() as cnx, cnx.cursor() as cursor:
                     cursor.execute(insert_table_definition, (t_name, csv_f))
 
-                    self.cnx.commit()
-            except Exception as e:
+                    cnx.commit()
+            except CSVCatalogBackend.database_errors as e:
+                if self.__in_transaction__():
+                    raise
                 print("Second created failed with e =  DataTableException: code: -101 , message: Table name %s is duplicate", t_name)
 
         
@@ -90,6 +120,61 @@ class TableDefinition:
     def __str__(self):
         pass
 
+    def __in_transaction__(self):
+        """
+        :return: True while CSVCatalog.create_table() runs its transaction. Database errors are then raised, so that
+            the whole create is rolled back, instead of printed.
+        """
+        return isinstance(self.cnx, CSVCatalogBackend.Transaction)
+
+    @contextlib.contextmanager
+    def __connection__(self):
+        """
+        :return: Context manager for the connection to use. This is the definition's own connection if it has one,
+            e.g. while CSVCatalog.create_table() runs its transaction, otherwise one borrowed from the catalog's pool.
+        """
+        if self.cnx is not None or self.catalog is None:
+            yield self.cnx
+        else:
+            with self.catalog.pool.connection() as cnx:
+                yield cnx
+
+    def __get_csv_header__(self):
+        if self.__csv_header__ is None:
+            with open(self.csv_f, "r", newline="", encoding="utf-8") as file:
+                reader = csv.reader(file, delimiter = ",")
+                self.__csv_header__ = next(reader)
+        return self.__csv_header__
+
+    def __get_column_types__(self):
+        """
+        :return: {column name: column type} of the defined columns.
+        """
+        if self.__column_types__ is None:
+            get_columns = "SELECT column_name, column_type FROM ColumnDefinitions where table_name = %s"
+            column_types = {}
+            try:
+                with self.__connection__() as cnx, cnx.cursor() as cursor:
+                    cursor.execute(get_columns, (self.t_name))
+                    result = cursor.fetchall()
+                    for item in result:
+                        column_types[item["column_name"]] = item["column_type"]
+                    cnx.commit()
+                self.__column_types__ = column_types
+            except CSVCatalogBackend.database_errors as be:
+                args = be.args
+                print("Got exception = ", be)
+            return column_types
+        return self.__column_types__
+
+    def __changed__(self):
+        """
+        Called after every change to the definition. Drops the loaded description and the catalog's cached copy.
+        """
+        self.json_data = dict()
+        if self.catalog is not None:
+            self.catalog.invalidate_table(self.t_name)
+
     @classmethod
     def load_table_definition(cls, cnx, table_name):
         """
@@ -104,12 +189,16 @@ class TableDefinition:
         columns = []
         indexes = dict()
         json_data = dict()
+        table = None
 
         try: 
             with cnx.cursor() as cursor:
                 
                 cursor.execute(description_query, (table_name))
                 result = cursor.fetchone()
+                if result is None:
+                    cnx.commit()
+                    return None
                 csv_f = result["path"]
                 json_data["defintion"] = result
 
@@ -122,13 +211,21 @@ class TableDefinition:
                 cursor.execute(index_query, (table_name))
                 result = cursor.fetchall()
                 for item in result:
-                    index_data = {"index_name": item["index_name"], "columns": item["columns"].split(","), "kind": item["kind"]}
+                    index_data = {"index_name": item["index_name"], "columns": parse_index_columns(item["columns"]), "kind": item["kind"]}
                     indexes[item["index_name"]] = index_data
                 json_data["indexes"] = indexes
 
-                table = cls(table_name, csv_f, columns, indexes, cnx)
+                # Not cls(table_name, csv_f, ...), which would try to insert the table again.
+                table = cls(cnx=cnx)
+                table.t_name = table_name
+                table.csv_f = csv_f
+                table.column_definitions = columns
+                table.index_definitions = indexes
+                # The description is complete, so describe_table() does not need to query it again.
+                table.json_data = json_data
+                table.__column_types__ = {c["column_name"]: c["column_type"] for c in columns}
                 cnx.commit()
-        except pymysql.MySQLError as be:
+        except CSVCatalogBackend.database_errors as be:
             args = be.args
             print("Got exception = ", be)
 
@@ -140,25 +237,37 @@ class TableDefinition:
         :param c: New column. Cannot be duplicate or column not in the file.
         :return: None
         """
-        #ADD COL DEF COLUM HERE, WITH SELF.TABLE_NAME AND AELF.FILENAME
-
+        self.add_column_definitions([c])
 
+    def add_column_definitions(self, cs):
+        """
+        Add several column definitions with one batched insert.
+        :param cs: List of new columns. Cannot be duplicate or columns not in the file.
+        :return: None
+        """
         insert_column_definition = """INSERT INTO ColumnDefinitions(
                                             table_name, file_name, column_name, column_type, not_null) 
                                         VALUES(%s, %s, %s, %s, %s)"""
-        with open(self.csv_f, "rU") as file:
-            reader = csv.reader(file, delimiter = ",")
-            column_names = next(reader)
+        column_names = self.__get_csv_header__()
 
-            c = c.to_json()
+        cs = [c.to_json() for c in cs]
+        for c in cs:
             if c["column_name"] not in column_names:
                 raise Exception("DataTableException: code: -100 , message: Column canary definition is invalid.")
 
         try:
-            with self.cnx.cursor() as cursor:
-                cursor.execute(insert_column_definition, (self.t_name, self.csv_f, c["column_name"], c["column_type"], c["not_null"]))
-                self.cnx.commit()
-        except pymysql.MySQLError as be:
+            with self.__connection__() as cnx, cnx.cursor() as cursor:
+                cursor.executemany(insert_column_definition,
+                                   [(self.t_name, self.csv_f, c["column_name"], c["column_type"], c["not_null"])
+                                    for c in cs])
+                cnx.commit()
+            if self.__column_types__ is not None:
+                for c in cs:
+                    self.__column_types__[c["column_name"]] = c["column_type"]
+            self.__changed__()
+        except CSVCatalogBackend.database_errors as be:
+            if self.__in_transaction__():
+                raise
             args = be.args
             print("Got exception = ", be)
 
@@ -170,10 +279,14 @@ class TableDefinition:
         """
         drop_column_definition = """DELETE FROM ColumnDefinitions WHERE column_name = %s"""
         try:
-            with self.cnx.cursor() as cursor:
+            with self.__connection__() as cnx, cnx.cursor() as cursor:
                 cursor.execute(drop_column_definition, (c))
-                self.cnx.commit()
-        except pymysql.MySQLError as be:
+                cnx.commit()
+            self.__column_types__ = None
+            self.__changed__()
+        except CSVCatalogBackend.database_errors as be:
+            if self.__in_transaction__():
+                raise
             args = be.args
             print("Got exception = ", be)
 
@@ -192,19 +305,8 @@ class TableDefinition:
         """
         insert_index_definition = """INSERT INTO IndexDefinitions(
                                             table_name, file_name, index_name, columns, kind) 
-                                        VALUES(%s, %s, %s, %r, %s)"""
-        columns_defined = []
-        try:
-            with self.cnx.cursor() as cursor:
-                get_columns = "SELECT column_name FROM ColumnDefinitions where table_name = %s"
-                cursor.execute(get_columns, (self.t_name))
-                result = cursor.fetchall()
-                for item in result:
-                    columns_defined.append(item["column_name"])
-                self.cnx.commit()
-        except pymysql.MySQLError as be:
-            args = be.args
-            print("Got exception = ", be)
+                                        VALUES(%s, %s, %s, %s, %s)"""
+        columns_defined = self.__get_column_types__()
 
         for column in columns:
             if column not in columns_defined:
@@ -212,12 +314,15 @@ class TableDefinition:
 
 
         try:
-            with self.cnx.cursor() as cursor:
+            with self.__connection__() as cnx, cnx.cursor() as cursor:
                 #var_string = '_'.join(columns[i] for i in range(len(columns)))#.split(",")
                 #print("HI", var_string)
-                cursor.execute(insert_index_definition, (self.t_name, self.csv_f, "PRIMARY", ', '.join(columns[i] for i in range(len(columns))), "PRIMARY"))
-                self.cnx.commit()
-        except pymysql.MySQLError as be:
+                cursor.execute(insert_index_definition, (self.t_name, self.csv_f, "PRIMARY", json.dumps(list(columns)), "PRIMARY"))
+                cnx.commit()
+            self.__changed__()
+        except CSVCatalogBackend.database_errors as be:
+            if self.__in_transaction__():
+                raise
             args = be.args
             print("Got exception = ", be)
 
@@ -227,36 +332,34 @@ class TableDefinition:
         Define or replace and index definition.
         :param index_name: Index name, must be unique within a table.
         :param columns: Valid list of columns.
-        :param kind: One of the valid index types.
+        :param kind: One of the valid index types, in any case. It is stored in upper case.
         :return:
         """
         insert_index_definition = """INSERT INTO IndexDefinitions(
                                             table_name, file_name, index_name, columns, kind) 
-                                        VALUES(%s, %s, %s, %r, %s)"""
-        columns_defined = []
-        try:
-            with self.cnx.cursor() as cursor:
-                get_columns = "SELECT column_name FROM ColumnDefinitions where table_name = %s"
-                cursor.execute(get_columns, (self.t_name))
-                result = cursor.fetchall()
-                for item in result:
-                    columns_defined.append(item["column_name"])
-                self.cnx.commit()
-        except pymysql.MySQLError as be:
-            args = be.args
-            print("Got exception = ", be)
+                                        VALUES(%s, %s, %s, %s, %s)"""
+        kind = str(kind).upper()
+        if kind not in IndexDefinition.index_types:
+            raise Exception("DataTableException: code: -1001, message: Invalid index kind " + str(kind))
+
+        columns_defined = self.__get_column_types__()
 
 
         for column in columns:
             if column not in columns_defined:
                 raise Exception("DataTableException: code: Invalid key columns, message: -1000")
+            if kind == "SORTED" and columns_defined[column] != "number":
+                raise Exception("DataTableException: code: -1002, message: Sorted index column " + column + " is not a number column")
 
 
         try:
-            with self.cnx.cursor() as cursor:
-                cursor.execute(insert_index_definition, (self.t_name, self.csv_f, index_name, ', '.join(columns[i] for i in range(len(columns))), kind))
-                self.cnx.commit()
-        except pymysql.MySQLError as be:
+            with self.__connection__() as cnx, cnx.cursor() as cursor:
+                cursor.execute(insert_index_definition, (self.t_name, self.csv_f, index_name, json.dumps(list(columns)), kind))
+                cnx.commit()
+            self.__changed__()
+        except CSVCatalogBackend.database_errors as be:
+            if self.__in_transaction__():
+                raise
             args = be.args
             print("Got exception = ", be)
 
@@ -271,15 +374,87 @@ class TableDefinition:
 
     def get_index_selectivity(self, index_name):
         """
-        :param index_name: Do not implement for now. Will cover in class.
-        :return:
+        :param index_name: Name of an index.
+        :return: Estimated fraction of the table's rows returned by a lookup of one key in the index, read from the
+            statistics saved by CSVTable.analyze(). None if the index columns have not been analyzed.
+        """
+        index = self.describe_table().get("indexes", {}).get(index_name)
+        if index is None:
+            raise Exception("DataTableException: code: -1003, message: Invalid index name " + str(index_name))
+
+        statistics = self.get_statistics()
+        keys = CSVStatistics.distinct_keys(statistics, index["columns"])
+        if keys is None:
+            return None
+        row_count = statistics[index["columns"][0]]["row_count"]
+        if str(index["kind"]).upper() in ("PRIMARY", "UNIQUE"):
+            keys = row_count
+        return 1.0 / max(keys, 1)
+
+    def get_statistics(self):
+        """
+        :return: dict of column name to statistics, see CSVStatistics.column_statistics(). Empty if the table has
+            not been analyzed.
         """
+        if self.__statistics__ is not None:
+            return self.__statistics__
+
+        statistics_query = """SELECT column_name, row_count, null_count, distinct_count, min_value, max_value,
+                                     most_common, histogram
+                                FROM ColumnStatistics WHERE table_name = %s"""
+        statistics = {}
+        try:
+            with self.__connection__() as cnx, cnx.cursor() as cursor:
+                cursor.execute(statistics_query, (self.t_name))
+                for item in cursor.fetchall():
+                    stats = dict(item)
+                    column_name = stats.pop("column_name")
+                    stats["most_common"] = json.loads(stats["most_common"] or "[]")
+                    stats["histogram"] = json.loads(stats["histogram"]) if stats["histogram"] else None
+                    statistics[column_name] = stats
+                cnx.commit()
+            self.__statistics__ = statistics
+        except CSVCatalogBackend.database_errors as be:
+            args = be.args
+            print("Got exception = ", be)
+        return statistics
+
+    def save_statistics(self, statistics):
+        """
+        Replace the table's statistics.
+        :param statistics: dict of column name to statistics, see CSVStatistics.column_statistics().
+        :return: None
+        """
+        delete_statistics = "DELETE FROM ColumnStatistics WHERE table_name = %s"
+        insert_statistics = """INSERT INTO ColumnStatistics(
+                                    table_name, column_name, row_count, null_count, distinct_count, min_value,
+                                    max_value, most_common, histogram)
+                                VALUES(%s, %s, %s, %s, %s, %s, %s, %s, %s)"""
+        rows = []
+        for column_name, stats in statistics.items():
+            histogram = json.dumps(stats["histogram"]) if stats["histogram"] is not None else None
+            rows.append((self.t_name, column_name, stats["row_count"], stats["null_count"], stats["distinct_count"],
+                         stats["min_value"], stats["max_value"], json.dumps(stats["most_common"]), histogram))
+        try:
+            with self.__connection__() as cnx, cnx.cursor() as cursor:
+                cursor.execute(delete_statistics, (self.t_name))
+                if rows:
+                    cursor.executemany(insert_statistics, rows)
+                cnx.commit()
+            self.__statistics__ = statistics
+        except CSVCatalogBackend.database_errors as be:
+            args = be.args
+            print("Got exception = ", be)
 
     def describe_table(self):
         """
         Simply wraps to_json()
-        :return: JSON representation.
+        :return: JSON representation. Read from the catalog tables unless the definition was loaded or described
+            since its last change.
         """
+        if "defintion" in self.json_data and "columns" in self.json_data and "indexes" in self.json_data:
+            return self.to_json()
+
         description_query = """SELECT table_name as name, file_name as path FROM TableDefinitions WHERE table_name = %s AND file_name = %s"""
         columns_query = """SELECT column_name, column_type, not_null FROM ColumnDefinitions WHERE table_name = %s AND file_name = %s"""
         index_query = """SELECT index_name, columns, kind FROM IndexDefinitions WHERE table_name = %s AND file_name = %s"""
@@ -288,7 +463,7 @@ class TableDefinition:
         indexes = dict()
 
         try: 
-            with self.cnx.cursor() as cursor:
+            with self.__connection__() as cnx, cnx.cursor() as cursor:
                 cursor.execute(description_query, (self.t_name, self.csv_f))
                 result = cursor.fetchone()
                 self.json_data["defintion"] = result
@@ -302,12 +477,12 @@ class TableDefinition:
                 cursor.execute(index_query, (self.t_name, self.csv_f))
                 result = cursor.fetchall()
                 for item in result:
-                    index_data = {"index_name": item["index_name"], "columns": item["columns"][1:-1].split(","), "kind": item["kind"]}
+                    index_data = {"index_name": item["index_name"], "columns": parse_index_columns(item["columns"]), "kind": item["kind"]}
                     indexes[item["index_name"]] = index_data
                 self.json_data["indexes"] = indexes
 
-                self.cnx.commit()
-        except pymysql.MySQLError as be:
+                cnx.commit()
+        except CSVCatalogBackend.database_errors as be:
             args = be.args
             print("Got exception = ", be)
         return self.to_json()
@@ -316,63 +491,105 @@ class TableDefinition:
 
 class CSVCatalog:
 
-    def __init__(self, dbhost="localhost", dbport="3306", dbname="CSVCatalog", dbuser="dbuser", dbpw="dbuser", debug_mode=None):
+    # Versions of the table definitions, {(database key, table name): version}. They are shared by every catalog
+    # on the same database in this process, so a change made through one catalog makes the definitions cached by
+    # all of them stale.
+    __versions__ = {}
+    __versions_lock__ = threading.Lock()
+
+    def __init__(self, dbhost="localhost", dbport="3306", dbname="CSVCatalog", dbuser="dbuser", dbpw="dbuser", debug_mode=None,
+                 backend=None, max_connections=4):
+        """
+        :param backend: Database holding the catalog tables, e.g. CSVCatalogBackend.SQLiteBackend("catalog.db").
+            If None, CSVCatalogBackend.default_backend() picks MySQL with the dbhost, ... parameters, unless the
+            CSV_CATALOG_SQLITE environment variable names an SQLite file.
+        :param max_connections: Size of the pool of connections to the backend, shared by the catalog and the
+            table definitions it returns.
+        """
+        if backend is None:
+            backend = CSVCatalogBackend.default_backend(dbhost, dbport, dbname, dbuser, dbpw)
+        self.backend = backend
+        self.pool = CSVCatalogBackend.ConnectionPool(backend, max_connections)
 
-        self.cnx = pymysql.connect(host=dbhost,
-                             user=dbuser,
-                             password=dbpw,
-                             db=dbname,
-                             charset='utf8mb4',
-                             cursorclass=pymysql.cursors.DictCursor)
+        # Loaded table definitions, {table name: (version, TableDefinition)}. The version of a table is bumped by
+        # every change made through any catalog on the database, which makes the cached definition stale.
+        self.__tables__ = {}
+        self.__database__ = backend.key
 
         drop_definitions = "DROP TABLE IF EXISTS TableDefinitions"
         drop_indexes = "DROP TABLE IF EXISTS IndexDefinitions"
         drop_columns = "DROP TABLE IF EXISTS ColumnDefinitions"
 
-        create_table_definitions = """CREATE TABLE IF NOT EXISTS TableDefinitions (
-                                        table_name varchar(255) PRIMARY KEY,
-                                        file_name text NOT NULL
-                                    );"""
-        create_column_definitions = """CREATE TABLE IF NOT EXISTS ColumnDefinitions (
-                                        table_name varchar(255) NOT NULL,
-                                        file_name text NOT NULL,
-                                        column_name varchar(255) NOT NULL,
-                                        column_type enum("text", "number"),
-                                        not_null tinyint(1)
-                                    );"""
-        create_index_definitions = """CREATE TABLE IF NOT EXISTS IndexDefinitions (
-                                        table_name text NOT NULL,
-                                        file_name text NOT NULL,
-                                        index_name varchar(255) PRIMARY KEY,
-                                        columns text NOT NULL,
-                                        kind enum("PRIMARY", "UNIQUE", "INDEX") NOT NULL
-                                    );"""
+        if self.__schema_is_current__():
+            return
 
         try: 
-            with self.cnx.cursor() as cursor:
+            with self.pool.connection() as cnx, cnx.cursor() as cursor:
                 #cursor.execute(drop_definitions)
                 #cursor.execute(drop_columns)
                 #cursor.execute(drop_indexes)
-                cursor.execute(create_table_definitions)
-                cursor.execute(create_index_definitions)
-                cursor.execute(create_column_definitions)
-                self.cnx.commit()
-        except pymysql.MySQLError as be:
+                for statement in backend.schema:
+                    cursor.execute(statement)
+                cursor.execute(CSVCatalogBackend.clear_schema_version)
+                cursor.execute(CSVCatalogBackend.set_schema_version, (CSVCatalogBackend.schema_version))
+                cnx.commit()
+        except CSVCatalogBackend.database_errors as be:
             args = be.args
             print("Got exception = ", be)
         #pass
 
+    def __schema_is_current__(self):
+        """
+        :return: True if the catalog tables were already created, with the current schema, in this database.
+        """
+        try:
+            # The pool rolls back the failed query.
+            with self.pool.connection() as cnx:
+                with cnx.cursor() as cursor:
+                    cursor.execute(CSVCatalogBackend.get_schema_version)
+                    result = cursor.fetchone()
+                cnx.commit()
+        except CSVCatalogBackend.database_errors:
+            # No CatalogSchema table yet.
+            return False
+        return result is not None and result["version"] == CSVCatalogBackend.schema_version
+
     def __str__(self):
         pass
 
-    def create_table(self, table_name, file_name, column_definitions=None, primary_key_columns=None):
+    def create_table(self, table_name, file_name, column_definitions=None, primary_key_columns=None,
+                     index_definitions=None):
+        """
+        Create a table with its columns, primary key and indexes. The definitions are inserted in one transaction,
+        which is rolled back if any of them is invalid or cannot be inserted, e.g. for an index name that is taken.
+        Raises an exception if the table already exists.
+        :param table_name: Name of the table.
+        :param file_name: Full path to the CSV file holding the data.
+        :param column_definitions: List of ColumnDefinitions.
+        :param primary_key_columns: List of primary key columns.
+        :param index_definitions: List of (index name, columns, kind) tuples.
+        :return: The TableDefinition.
+        """
+        find_table = "SELECT table_name FROM TableDefinitions WHERE table_name = %s"
 
-        table = TableDefinition(table_name, file_name, column_definitions, primary_key_columns, self.cnx)
-        if column_definitions:
-            for column_definition in column_definitions:
-                table.add_column_definition(column_definition)
-        if primary_key_columns:
-            table.define_primary_key(primary_key_columns)
+        self.invalidate_table(table_name)
+        with self.pool.connection() as cnx:
+            with cnx.cursor() as cursor:
+                cursor.execute(find_table, (table_name))
+                if cursor.fetchone() is not None:
+                    raise Exception("DataTableException: code: -101 , message: Table name " + str(table_name) +
+                                    " is duplicate")
+            table = TableDefinition(table_name, file_name, column_definitions, primary_key_columns,
+                                    CSVCatalogBackend.Transaction(cnx))
+            table.catalog = self
+            if column_definitions:
+                table.add_column_definitions(column_definitions)
+            if primary_key_columns:
+                table.define_primary_key(primary_key_columns)
+            for index_name, columns, kind in index_definitions or []:
+                table.define_index(index_name, columns, kind)
+            cnx.commit()
+        table.cnx = None
 
         return table
 
@@ -380,25 +597,49 @@ class CSVCatalog:
         drop_table_query1 = "DELETE FROM TableDefinitions WHERE table_name = %s"
         drop_table_query2 = "DELETE FROM ColumnDefinitions WHERE table_name = %s"
         drop_table_query3 = "DELETE FROM IndexDefinitions WHERE table_name = %s"
+        drop_table_query4 = "DELETE FROM ColumnStatistics WHERE table_name = %s"
 
         try:
-            with self.cnx.cursor() as cursor:
+            with self.pool.connection() as cnx, cnx.cursor() as cursor:
                 cursor.execute(drop_table_query1, (table_name))
                 cursor.execute(drop_table_query2, (table_name))
                 cursor.execute(drop_table_query3, (table_name))
-                self.cnx.commit()
-        except pymysql.MySQLError as be:
+                cursor.execute(drop_table_query4, (table_name))
+                cnx.commit()
+        except CSVCatalogBackend.database_errors as be:
             args = be.args
             print("Got exception = ", be)
+        self.invalidate_table(table_name)
+
+    def invalidate_table(self, table_name):
+        """
+        Mark the cached definition of a table as stale, in every catalog on the same database.
+        :param table_name: Name of the table.
+        :return: None
+        """
+        key = (self.__database__, table_name)
+        with CSVCatalog.__versions_lock__:
+            CSVCatalog.__versions__[key] = CSVCatalog.__versions__.get(key, 0) + 1
 
 
     def get_table(self, table_name):
         """
         Returns a previously created table.
         :param table_name: Name of the table.
-        :return:
+        :return: TableDefinition, or None if there is no such table. Definitions are cached, so opening a table
+            whose definition has not changed since it was last loaded does not query the database.
         """
-        table = TableDefinition()
-        table = table.load_table_definition(self.cnx, table_name)
+        version = CSVCatalog.__versions__.get((self.__database__, table_name), 0)
+        cached = self.__tables__.get(table_name)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+
+        with self.pool.connection() as cnx:
+            table = TableDefinition.load_table_definition(cnx, table_name)
+        if table is not None:
+            # Later changes borrow their own connections.
+            table.cnx = None
+            table.catalog = self
+            self.__tables__[table_name] = (version, table)
         return table
         
\ No newline at end of file
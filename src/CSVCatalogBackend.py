@@ -0,0 +1,290 @@
+"""
+Database backends for CSVCatalog. A backend opens the connection that holds the TableDefinitions,
+ColumnDefinitions and IndexDefinitions tables, and knows the statements that create them. Its key identifies the
+database, so that every catalog on the same database sees the changes to the table definitions made by the others.
+
+Connections follow the pymysql interface used by the catalog: cursor() is a context manager whose execute() takes
+a query with %s parameters, and whose fetchone() and fetchall() return rows as dicts.
+"""
+
+import contextlib
+import os
+import sqlite3
+import threading
+
+# Errors the catalog handles. pymysql is only imported when a MySQL catalog is opened, which adds its errors.
+database_errors = (sqlite3.Error,)
+
+# Version of the catalog tables' schema. A database whose CatalogSchema table holds this version already has every
+# catalog table, so opening a catalog on it runs no DDL.
+schema_version = 2
+
+get_schema_version = "SELECT version FROM CatalogSchema"
+clear_schema_version = "DELETE FROM CatalogSchema"
+set_schema_version = "INSERT INTO CatalogSchema(version) VALUES(%s)"
+
+# Environment variable naming an SQLite catalog file. If set, it is used instead of MySQL by default.
+sqlite_env_var = "CSV_CATALOG_SQLITE"
+
+
+class MySQLBackend:
+    """
+    Catalog tables in a MySQL database.
+    """
+
+    schema = [
+        """CREATE TABLE IF NOT EXISTS TableDefinitions (
+                table_name varchar(255) PRIMARY KEY,
+                file_name text NOT NULL
+            );""",
+        """CREATE TABLE IF NOT EXISTS IndexDefinitions (
+                table_name text NOT NULL,
+                file_name text NOT NULL,
+                index_name varchar(255) PRIMARY KEY,
+                columns text NOT NULL,
+                kind enum("PRIMARY", "UNIQUE", "INDEX", "SORTED", "BITMAP") NOT NULL
+            );""",
+        # Catalogs created before the SORTED and BITMAP kinds existed.
+        """ALTER TABLE IndexDefinitions
+                MODIFY kind enum("PRIMARY", "UNIQUE", "INDEX", "SORTED", "BITMAP") NOT NULL""",
+        """CREATE TABLE IF NOT EXISTS ColumnDefinitions (
+                table_name varchar(255) NOT NULL,
+                file_name text NOT NULL,
+                column_name varchar(255) NOT NULL,
+                column_type enum("text", "number"),
+                not_null tinyint(1)
+            );""",
+        """CREATE TABLE IF NOT EXISTS ColumnStatistics (
+                table_name varchar(255) NOT NULL,
+                column_name varchar(255) NOT NULL,
+                row_count int NOT NULL,
+                null_count int NOT NULL,
+                distinct_count int NOT NULL,
+                min_value double,
+                max_value double,
+                most_common text,
+                histogram text,
+                PRIMARY KEY (table_name, column_name)
+            );""",
+        """CREATE TABLE IF NOT EXISTS CatalogSchema (
+                version int NOT NULL
+            );"""
+    ]
+
+    def __init__(self, dbhost="localhost", dbport="3306", dbname="CSVCatalog", dbuser="dbuser", dbpw="dbuser"):
+        self.dbhost = dbhost
+        self.dbport = dbport
+        self.dbname = dbname
+        self.dbuser = dbuser
+        self.dbpw = dbpw
+        # Identifies the database, for the table definition versions shared by the catalogs on it.
+        self.key = ("mysql", dbhost, str(dbport), dbname)
+
+    def connect(self):
+        global database_errors
+        try:
+            import pymysql
+        except ImportError:
+            raise ImportError("pymysql is required for a MySQL catalog. Install it, or use an SQLiteBackend.")
+        if pymysql.MySQLError not in database_errors:
+            database_errors = database_errors + (pymysql.MySQLError,)
+        return pymysql.connect(host=self.dbhost,
+                               port=int(self.dbport),
+                               user=self.dbuser,
+                               password=self.dbpw,
+                               db=self.dbname,
+                               charset='utf8mb4',
+                               cursorclass=pymysql.cursors.DictCursor)
+
+
+class _SQLiteCursor:
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cursor.close()
+        return False
+
+    def __params__(self, args):
+        # Like pymysql, accept a single value as well as a sequence of values.
+        if args is None:
+            return ()
+        if isinstance(args, (tuple, list, dict)):
+            return args
+        return (args,)
+
+    def execute(self, query, args=None):
+        self.cursor.execute(query.replace("%s", "?"), self.__params__(args))
+        return self.cursor.rowcount
+
+    def executemany(self, query, args):
+        self.cursor.executemany(query.replace("%s", "?"), [self.__params__(a) for a in args])
+        return self.cursor.rowcount
+
+    def fetchone(self):
+        row = self.cursor.fetchone()
+        return dict(row) if row is not None else None
+
+    def fetchall(self):
+        return [dict(row) for row in self.cursor.fetchall()]
+
+
+class _SQLiteConnection:
+
+    def __init__(self, cnx):
+        self.cnx = cnx
+
+    def cursor(self):
+        return _SQLiteCursor(self.cnx.cursor())
+
+    def commit(self):
+        self.cnx.commit()
+
+    def rollback(self):
+        self.cnx.rollback()
+
+    def close(self):
+        self.cnx.close()
+
+
+class SQLiteBackend:
+    """
+    Catalog tables in an embedded SQLite database, either a file or in memory. Needs no server.
+    """
+
+    schema = [
+        """CREATE TABLE IF NOT EXISTS TableDefinitions (
+                table_name varchar(255) PRIMARY KEY,
+                file_name text NOT NULL
+            );""",
+        """CREATE TABLE IF NOT EXISTS IndexDefinitions (
+                table_name text NOT NULL,
+                file_name text NOT NULL,
+                index_name varchar(255) PRIMARY KEY,
+                columns text NOT NULL,
+                kind text NOT NULL CHECK (kind IN ('PRIMARY', 'UNIQUE', 'INDEX', 'SORTED', 'BITMAP'))
+            );""",
+        """CREATE TABLE IF NOT EXISTS ColumnDefinitions (
+                table_name varchar(255) NOT NULL,
+                file_name text NOT NULL,
+                column_name varchar(255) NOT NULL,
+                column_type text CHECK (column_type IN ('text', 'number')),
+                not_null integer
+            );""",
+        """CREATE TABLE IF NOT EXISTS ColumnStatistics (
+                table_name varchar(255) NOT NULL,
+                column_name varchar(255) NOT NULL,
+                row_count integer NOT NULL,
+                null_count integer NOT NULL,
+                distinct_count integer NOT NULL,
+                min_value real,
+                max_value real,
+                most_common text,
+                histogram text,
+                PRIMARY KEY (table_name, column_name)
+            );""",
+        """CREATE TABLE IF NOT EXISTS CatalogSchema (
+                version integer NOT NULL
+            );"""
+    ]
+
+    def __init__(self, path=":memory:"):
+        """
+        :param path: Database file, or ":memory:" for a catalog that only lives as long as the connection.
+        """
+        self.path = path
+        # Every connection to ":memory:" is a different database.
+        self.max_connections = 1 if path == ":memory:" else None
+        # Identifies the database, for the table definition versions shared by the catalogs on it.
+        if path == ":memory:":
+            self.key = ("sqlite", path, id(self))
+        else:
+            self.key = ("sqlite", os.path.abspath(path))
+
+    def connect(self):
+        # The connection may be shared by threads. Callers serialize their use of it.
+        cnx = sqlite3.connect(self.path, check_same_thread=False)
+        cnx.row_factory = sqlite3.Row
+        return _SQLiteConnection(cnx)
+
+
+def default_backend(dbhost="localhost", dbport="3306", dbname="CSVCatalog", dbuser="dbuser", dbpw="dbuser"):
+    """
+    :return: An SQLiteBackend on the file named by the CSV_CATALOG_SQLITE environment variable if it is set,
+        otherwise a MySQLBackend with the given connection parameters.
+    """
+    path = os.environ.get(sqlite_env_var)
+    if path:
+        return SQLiteBackend(path)
+    return MySQLBackend(dbhost, dbport, dbname, dbuser, dbpw)
+
+
+class Transaction:
+    """
+    Wraps a connection so that a sequence of catalog operations runs as one transaction. The operations' own
+    commits are skipped, and the owner of the transaction commits or rolls back the connection at the end.
+    """
+
+    def __init__(self, cnx):
+        self.cnx = cnx
+
+    def cursor(self):
+        return self.cnx.cursor()
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        self.cnx.rollback()
+
+
+class ConnectionPool:
+    """
+    A bounded pool of connections to a backend. Connections are opened on demand, up to max_connections, and
+    reused. A caller that needs a connection when all of them are in use waits for one to be returned.
+    """
+
+    def __init__(self, backend, max_connections=4):
+        """
+        :param backend: Backend whose connect() opens the connections.
+        :param max_connections: Max number of open connections. The backend may allow fewer, e.g. an in memory
+            SQLite database only exists on one connection.
+        """
+        backend_max = getattr(backend, "max_connections", None)
+        if backend_max is not None:
+            max_connections = min(max_connections, backend_max)
+        self.backend = backend
+        self.max_connections = max_connections
+        self.idle = []
+        self.lock = threading.Lock()
+        self.available = threading.BoundedSemaphore(max_connections)
+
+    @contextlib.contextmanager
+    def connection(self):
+        """
+        :return: Context manager that borrows a connection and returns it to the pool on exit. If the block
+            raises, its uncommitted changes are rolled back.
+        """
+        self.available.acquire()
+        try:
+            with self.lock:
+                cnx = self.idle.pop() if self.idle else None
+            if cnx is None:
+                cnx = self.backend.connect()
+            try:
+                yield cnx
+            except BaseException:
+                try:
+                    cnx.rollback()
+                except database_errors:
+                    pass
+                raise
+            finally:
+                with self.lock:
+                    self.idle.append(cnx)
+        finally:
+            self.available.release()
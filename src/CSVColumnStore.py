@@ -0,0 +1,333 @@
+import array
+
+import CSVLoader
+import CSVPredicate
+import DataTableExceptions
+
+
+def _select_matching(check, row_ids, row_count):
+    if check is None:
+        return []
+    if row_ids is None:
+        row_ids = range(row_count)
+    return [i for i in row_ids if check(i)]
+
+
+def _take(data, typecode, row_ids):
+    # Copy the values of some rows into a new array. A range of rows is copied as raw bytes.
+    result = array.array(typecode)
+    if isinstance(row_ids, range) and row_ids.step == 1:
+        result.frombytes(data[row_ids.start:row_ids.stop].tobytes())
+    else:
+        result.extend(map(data.__getitem__, row_ids))
+    return result
+
+
+class TextColumn:
+    """
+    A dictionary encoded column of strings. Each distinct value is stored once, and every row holds a small
+    integer code for its value.
+    """
+
+    def __init__(self, codes=None, values=None):
+        """
+        :param codes: Existing codes, e.g. a memoryview on a snapshot file. Copied on the first append.
+        :param values: Existing dictionary of values, indexed by code.
+        """
+        self.codes = array.array("i") if codes is None else codes   # row id -> code
+        self.values = [] if values is None else values                # code -> value
+        self.lookup = {v: code for code, v in enumerate(self.values)} # value -> code
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, row_id):
+        return self.values[self.codes[row_id]]
+
+    def __iter__(self):
+        return map(self.values.__getitem__, self.codes)
+
+    def __reduce__(self):
+        # The lookup is rebuilt from the values, so it is not pickled.
+        return TextColumn, (self.codes, self.values)
+
+    def append(self, v):
+        if not isinstance(self.codes, array.array):
+            self.codes = array.array("i", self.codes)
+        code = self.lookup.get(v)
+        if code is None:
+            code = len(self.values)
+            self.lookup[v] = code
+            self.values.append(v)
+        self.codes.append(code)
+
+    def coerce(self, v):
+        return v
+
+    def take(self, row_ids):
+        """
+        :param row_ids: A range or list of row ids.
+        :return: A TextColumn holding the values of those rows. It shares the dictionary of values.
+        """
+        return TextColumn(_take(self.codes, "i", row_ids), self.values)
+
+    def distinct_count(self):
+        return len(self.values)
+
+    def select(self, v, row_ids=None):
+        """
+        :param v: Value to match, or a range predicate.
+        :param row_ids: Candidate row ids, or None for all rows.
+        :return: List of the row ids whose value equals v.
+        """
+        if CSVPredicate.is_range(v):
+            return _select_matching(self.matcher(v), row_ids, len(self))
+        code = self.lookup.get(v)
+        if code is None:
+            return []
+        codes = self.codes
+        if row_ids is None:
+            return [i for i, c in enumerate(codes) if c == code]
+        return [i for i in row_ids if codes[i] == code]
+
+    def matcher(self, v):
+        """
+        :param v: Value to match, or a range predicate.
+        :return: Function of a row id that is True if the row's value equals v, or None if no row can match.
+        """
+        if CSVPredicate.is_range(v):
+            # Compare the distinct values once, then test codes.
+            in_range = CSVPredicate.compile_template({"v": v})
+            matching = set(code for code, x in enumerate(self.values) if in_range({"v": x}))
+            if not matching:
+                return None
+            codes = self.codes
+            return lambda i: codes[i] in matching
+        code = self.lookup.get(v)
+        if code is None:
+            return None
+        codes = self.codes
+        return lambda i: codes[i] == code
+
+
+class NumberColumn:
+    """
+    A column of numbers stored as doubles. Empty values are NULL. They are stored as NaN and read back as None.
+    Whole numbers are read back as ints, and other values as floats.
+    """
+
+    null = float("nan")
+
+    def __init__(self, data=None):
+        """
+        :param data: Existing values, e.g. a memoryview on a snapshot file. Copied on the first append.
+        """
+        self.data = array.array("d") if data is None else data
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, row_id):
+        v = self.data[row_id]
+        if v != v:
+            return None
+        return int(v) if v.is_integer() else v
+
+    def __iter__(self):
+        for v in self.data:
+            if v != v:
+                yield None
+            else:
+                yield int(v) if v.is_integer() else v
+
+    def append(self, v):
+        if not isinstance(self.data, array.array):
+            self.data = array.array("d", self.data)
+        v = self.coerce(v)
+        self.data.append(self.null if v is None else v)
+
+    @staticmethod
+    def coerce(v):
+        """
+        :param v: A number, or a string holding a number.
+        :return: The value as an int if it is a whole number and as a float otherwise, or None for NULL.
+        """
+        if v is None or v == "":
+            return None
+        try:
+            return CSVLoader.parse_number(v)
+        except (TypeError, ValueError):
+            raise DataTableExceptions.DataTableException(-2, "Invalid value for number column = " + str(v))
+
+    def take(self, row_ids):
+        """
+        :param row_ids: A range or list of row ids.
+        :return: A NumberColumn holding the values of those rows.
+        """
+        return NumberColumn(_take(self.data, "d", row_ids))
+
+    def distinct_count(self):
+        return len(set(self.data))
+
+    def select(self, v, row_ids=None):
+        """
+        :param v: Value to match, or a range predicate. None matches NULL.
+        :param row_ids: Candidate row ids, or None for all rows.
+        :return: List of the row ids whose value equals v.
+        """
+        if CSVPredicate.is_range(v):
+            return _select_matching(self.matcher(v), row_ids, len(self))
+        v = self.coerce(v)
+        data = self.data
+        if v is None:
+            if row_ids is None:
+                return [i for i, x in enumerate(data) if x != x]
+            return [i for i in row_ids if data[i] != data[i]]
+        if row_ids is None:
+            return [i for i, x in enumerate(data) if x == v]
+        return [i for i in row_ids if data[i] == v]
+
+    def matcher(self, v):
+        """
+        :param v: Value to match, or a range predicate. None matches NULL.
+        :return: Function of a row id that is True if the row's value equals v.
+        """
+        if CSVPredicate.is_range(v):
+            lo, lo_inclusive, hi, hi_inclusive = CSVPredicate.range_bounds(CSVPredicate.map_range(v, self.coerce))
+            data = self.data
+            # NaN (NULL) compares False, so NULL never matches a range.
+            if lo is not None and hi is not None:
+                if lo_inclusive and hi_inclusive:
+                    return lambda i: lo <= data[i] <= hi
+                return lambda i: (lo <= data[i] if lo_inclusive else lo < data[i]) and \
+                    (data[i] <= hi if hi_inclusive else data[i] < hi)
+            if lo is not None:
+                return (lambda i: lo <= data[i]) if lo_inclusive else (lambda i: lo < data[i])
+            if hi is not None:
+                return (lambda i: data[i] <= hi) if hi_inclusive else (lambda i: data[i] < hi)
+            return lambda i: data[i] == data[i]
+        v = self.coerce(v)
+        data = self.data
+        if v is None:
+            return lambda i: data[i] != data[i]
+        return lambda i: data[i] == v
+
+
+class ColumnStore:
+    """
+    Columnar in-memory storage for a CSVTable. There is one compact array per column. Rows only exist as
+    dictionaries when they are materialized with row() or rows().
+    """
+
+    def __init__(self, column_names, column_types=None, columns=None, row_count=0):
+        """
+        :param column_names: List of column names in table order.
+        :param column_types: dict of column name to catalog column type. Columns of type "number" are
+            stored as numbers, all others as dictionary encoded text.
+        :param columns: Existing columns by name, e.g. read from a snapshot file, instead of empty ones.
+        :param row_count: Number of rows in the existing columns.
+        """
+        column_types = column_types or {}
+        self.column_names = list(column_names)
+        if columns is not None:
+            self.columns = {c: columns[c] for c in self.column_names}
+        else:
+            self.columns = {}
+            for c in self.column_names:
+                if column_types.get(c) == "number":
+                    self.columns[c] = NumberColumn()
+                else:
+                    self.columns[c] = TextColumn()
+        self.row_count = row_count
+
+    def __len__(self):
+        return self.row_count
+
+    def get_column(self, column_name):
+        try:
+            return self.columns[column_name]
+        except KeyError:
+            raise DataTableExceptions.DataTableException(-2, "Invalid field = " + str(column_name))
+
+    def append(self, row):
+        """
+        :param row: dict holding a value for every column.
+        :return: None
+        """
+        for c, column in self.columns.items():
+            column.append(row[c])
+        self.row_count += 1
+
+    def append_values(self, values):
+        """
+        :param values: Sequence holding a value for every column, in column_names order.
+        :return: None
+        """
+        for column, v in zip(self.columns.values(), values):
+            column.append(v)
+        self.row_count += 1
+
+    def row(self, row_id, fields=None):
+        fields = self.column_names if fields is None else fields
+        return {f: self.get_column(f)[row_id] for f in fields}
+
+    def rows(self, row_ids, fields=None):
+        """
+        Materialize rows.
+        :param row_ids: Iterable of row ids.
+        :param fields: Columns to include, or None for all.
+        :return: List of dicts.
+        """
+        fields = list(self.column_names if fields is None else fields)
+        columns = [self.get_column(f) for f in fields]
+        return [dict(zip(fields, [c[row_id] for c in columns])) for row_id in row_ids]
+
+    def iter_rows(self, row_ids, fields=None):
+        """
+        Streaming version of rows().
+        """
+        fields = list(self.column_names if fields is None else fields)
+        columns = [self.get_column(f) for f in fields]
+        for row_id in row_ids:
+            yield dict(zip(fields, [c[row_id] for c in columns]))
+
+    def take(self, fields, row_ids):
+        """
+        Copy some rows of some columns, e.g. to send them to a worker process. The columns are compact arrays,
+        which pickle as raw bytes.
+        :param fields: Column names.
+        :param row_ids: A range or list of row ids.
+        :return: List of columns, one per field, holding the values of the rows in order.
+        """
+        return [self.get_column(f).take(row_ids) for f in fields]
+
+    def iter_select(self, t, row_ids=None):
+        """
+        Streaming version of select().
+        :return: Iterator over the matching row ids, in order.
+        """
+        checks = []
+        for k, v in t.items():
+            check = self.get_column(k).matcher(v)
+            if check is None:
+                return iter(())
+            checks.append(check)
+        if row_ids is None:
+            row_ids = range(self.row_count)
+        if len(checks) == 1:
+            return filter(checks[0], row_ids)
+        return (i for i in row_ids if all(check(i) for check in checks))
+
+    def select(self, t, row_ids=None):
+        """
+        :param t: A template of column name to value.
+        :param row_ids: Candidate row ids, or None for all rows.
+        :return: List of the row ids matching every column in the template.
+        """
+        for k, v in t.items():
+            row_ids = self.get_column(k).select(v, row_ids)
+            if not row_ids:
+                return []
+        if row_ids is None:
+            row_ids = list(range(self.row_count))
+        return row_ids
@@ -0,0 +1,282 @@
+"""
+Index structures for CSVTable. Keys are the typed column values, as stored by the table: the value itself for a one
+column index, and a tuple of the values otherwise, which is what operator.itemgetter returns for a row or template.
+"""
+
+import array
+import bisect
+import operator
+
+import CSVPredicate
+
+
+def key_getter(columns):
+    """
+    :param columns: List of index columns.
+    :return: Function of a row or template that returns its index key.
+    """
+    return operator.itemgetter(*columns)
+
+
+class HashIndex:
+    """
+    An equality index: a dict of key to the list of row ids with that key.
+    """
+
+    def __init__(self, columns):
+        """
+        :param columns: List of index columns.
+        """
+        self.columns = list(columns)
+        self.key = key_getter(self.columns)
+        self.table = {}
+
+    def __len__(self):
+        """
+        :return: Number of distinct keys.
+        """
+        return len(self.table)
+
+    def build(self, values):
+        """
+        :param values: Iterable over rows in row id order, yielding a list of the index column values for each row.
+        :return: None
+        """
+        table = {}
+        if len(self.columns) == 1:
+            keys = (v[0] for v in values)
+        else:
+            keys = map(tuple, values)
+        for row_id, key in enumerate(keys):
+            ids = table.get(key)
+            if ids is None:
+                table[key] = ids = []
+            ids.append(row_id)
+        self.table = table
+
+    def lookup(self, t):
+        """
+        :param t: A row or template holding a value for every column in the index.
+        :return: List of the matching row ids. The caller must not modify it.
+        """
+        return self.table.get(self.key(t), [])
+
+
+class SortedIndex:
+    """
+    A sorted index: the index keys in sorted order, with the row id of each key in a parallel array. Equality and
+    range lookups are a binary search plus a slice, O(log n + k). Rows with a NULL in any index column are kept
+    in a separate list.
+    """
+
+    def __init__(self, columns, number_columns=()):
+        """
+        :param columns: List of index columns. Range lookups use the first column.
+        :param number_columns: Index columns the catalog types as "number". Their keys are compared as numbers.
+        """
+        self.columns = list(columns)
+        self.numeric = [c in number_columns for c in self.columns]
+        self.keys = []
+        self.row_ids = array.array("i")
+        self.null_row_ids = []
+        self.distinct_keys = 0
+
+    def __len__(self):
+        """
+        :return: Number of distinct keys, not counting NULLs.
+        """
+        return self.distinct_keys
+
+    def __key__(self, values):
+        key = []
+        for v, numeric in zip(values, self.numeric):
+            if v is None or (numeric and v == ""):
+                return None
+            key.append(float(v) if numeric else v)
+        return tuple(key)
+
+    def build(self, values):
+        """
+        :param values: Iterable over rows in row id order, yielding a list of the index column values for each row.
+        :return: None
+        """
+        entries = []
+        self.null_row_ids = []
+        for row_id, v in enumerate(values):
+            key = self.__key__(v)
+            if key is None:
+                self.null_row_ids.append(row_id)
+            else:
+                entries.append((key, row_id))
+        entries.sort()
+        self.keys = [k for k, row_id in entries]
+        self.row_ids = array.array("i", [row_id for k, row_id in entries])
+        self.distinct_keys = sum(1 for i, k in enumerate(self.keys) if i == 0 or k != self.keys[i - 1])
+
+    def lookup(self, values):
+        """
+        :param values: List of values, one per index column.
+        :return: List of row ids whose key equals values. A NULL value returns every row with a NULL key, which
+            the caller must filter.
+        """
+        key = self.__key__(values)
+        if key is None:
+            return list(self.null_row_ids)
+        lo = bisect.bisect_left(self.keys, key)
+        hi = bisect.bisect_right(self.keys, key, lo)
+        return self.row_ids[lo:hi].tolist()
+
+    def range(self, lo=None, lo_inclusive=True, hi=None, hi_inclusive=True):
+        """
+        Range lookup on the first index column.
+        :param lo: Low bound, or None for unbounded.
+        :param lo_inclusive: True if the low bound is included.
+        :param hi: High bound, or None for unbounded.
+        :param hi_inclusive: True if the high bound is included.
+        :return: List of row ids, in key order.
+        """
+        first = operator.itemgetter(0)
+        if self.numeric[0]:
+            lo = None if lo is None else float(lo)
+            hi = None if hi is None else float(hi)
+        start, end = 0, len(self.keys)
+        if lo is not None:
+            if lo_inclusive:
+                start = bisect.bisect_left(self.keys, lo, key=first)
+            else:
+                start = bisect.bisect_right(self.keys, lo, key=first)
+        if hi is not None:
+            if hi_inclusive:
+                end = bisect.bisect_right(self.keys, hi, lo=start, key=first)
+            else:
+                end = bisect.bisect_left(self.keys, hi, lo=start, key=first)
+        if end <= start:
+            return []
+        return self.row_ids[start:end].tolist()
+
+    def find(self, t):
+        """
+        :param t: A template with a predicate on the first index column.
+        :return: Candidate row ids for the template, in table order like the candidates from the other indexes, so
+            results and what limit and offset select do not depend on the index used. The caller filters them with
+            the full template.
+        """
+        v = t[self.columns[0]]
+        if CSVPredicate.is_range(v):
+            row_ids = self.range(*CSVPredicate.range_bounds(v))
+        elif all(c in t and not CSVPredicate.is_range(t[c]) for c in self.columns):
+            # Equal keys are already in row id order.
+            return self.lookup([t[c] for c in self.columns])
+        elif v is None or (self.numeric[0] and v == ""):
+            return list(self.null_row_ids)
+        else:
+            row_ids = self.range(v, True, v, True)
+        row_ids.sort()
+        return row_ids
+
+
+class BitmapIndex:
+    """
+    A bitmap index for columns with few distinct values. Each key has a bitmap with bit i set if row i has that
+    key. A bitmap is a Python int, so combining predicates is a single & of the bitmaps.
+    """
+
+    def __init__(self, columns):
+        """
+        :param columns: List of index columns.
+        """
+        self.columns = list(columns)
+        self.key = key_getter(self.columns)
+        self.bitmaps = {}
+        self.row_count = 0
+
+    def __len__(self):
+        """
+        :return: Number of distinct keys.
+        """
+        return len(self.bitmaps)
+
+    def build(self, values):
+        """
+        :param values: Iterable over rows in row id order, yielding a list of the index column values for each row.
+        :return: None
+        """
+        row_ids = {}
+        row_count = 0
+        one_column = len(self.columns) == 1
+        for row_id, v in enumerate(values):
+            key = v[0] if one_column else tuple(v)
+            ids = row_ids.get(key)
+            if ids is None:
+                row_ids[key] = ids = []
+            ids.append(row_id)
+            row_count = row_id + 1
+
+        # Set the bits in a little endian byte array, then convert it to an int once.
+        self.bitmaps = {}
+        for key, ids in row_ids.items():
+            bits = bytearray((row_count + 7) // 8)
+            for i in ids:
+                bits[i >> 3] |= 1 << (i & 7)
+            self.bitmaps[key] = int.from_bytes(bits, "little")
+        self.row_count = row_count
+
+    def lookup(self, t):
+        """
+        :param t: A row or template holding a value for every column in the index.
+        :return: Bitmap of the matching rows.
+        """
+        return self.bitmaps.get(self.key(t), 0)
+
+    def row_ids(self, bitmap):
+        """
+        :param bitmap: A bitmap, e.g. the & of several lookups.
+        :return: List of the row ids whose bits are set, in order.
+        """
+        result = []
+        for byte_index, b in enumerate(bitmap.to_bytes((self.row_count + 7) // 8, "little")):
+            if b:
+                base = byte_index << 3
+                for bit in range(8):
+                    if b >> bit & 1:
+                        result.append(base + bit)
+        return result
+
+    def filter(self, bitmap, row_ids):
+        """
+        :param bitmap: A bitmap.
+        :param row_ids: Candidate row ids.
+        :return: List of the row ids in row_ids whose bits are set.
+        """
+        bits = bitmap.to_bytes((self.row_count + 7) // 8, "little")
+        return [i for i in row_ids if bits[i >> 3] >> (i & 7) & 1]
+
+
+def build_index(kind, columns, number_columns, values):
+    """
+    Build one index. This is a module level function so that indexes can be built in worker processes.
+    :param kind: Index kind from the catalog, e.g. "INDEX", "SORTED" or "BITMAP".
+    :param columns: List of index columns.
+    :param number_columns: Columns the catalog types as "number".
+    :param values: Iterable over rows in row id order, yielding a list of the index column values for each row.
+    :return: A SortedIndex, a BitmapIndex, or a HashIndex for the other kinds.
+    """
+    kind = str(kind).upper()
+    if kind == "SORTED":
+        index = SortedIndex(columns, number_columns)
+    elif kind == "BITMAP":
+        index = BitmapIndex(columns)
+    else:
+        index = HashIndex(columns)
+    index.build(values)
+    return index
+
+
+def build_index_columns(kind, columns, number_columns, column_values):
+    """
+    Build one index over whole index columns, e.g. copies of a table's columns sent to a worker process, instead of
+    over a row by row iterator.
+    :param column_values: List holding all the values of each index column, in row id order.
+    :return: See build_index().
+    """
+    return build_index(kind, columns, number_columns, zip(*column_values))
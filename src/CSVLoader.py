@@ -0,0 +1,176 @@
+"""
+Parallel loading of CSV files. The file is split into byte ranges that start and end on record boundaries, and each
+range is parsed and projected by a worker process. This module does not import the catalog, so worker processes
+can import it cheaply.
+"""
+
+import csv
+import io
+import operator
+
+
+def _next_record_start(data, pos, quotes):
+    """
+    :param data: File contents.
+    :param pos: Offset to search from.
+    :param quotes: Number of quote characters in data before pos.
+    :return: (offset of the first record that starts at or after pos, number of quote characters before it).
+        A newline only ends a record if it is not inside a quoted field, i.e. if an even number of quote
+        characters precedes it. Escaped quotes ("") do not change the parity.
+    """
+    size = len(data)
+    while pos < size:
+        nl = data.find(b"\n", pos)
+        if nl < 0:
+            return size, quotes + data.count(b'"', pos, size)
+        quotes += data.count(b'"', pos, nl)
+        pos = nl + 1
+        if quotes % 2 == 0:
+            return pos, quotes
+    return size, quotes
+
+
+def split_file(fn, chunk_count):
+    """
+    Split the data records of a CSV file into byte ranges of about equal size. Every range starts and ends on a
+    record boundary, so quoted fields that contain newlines are never split.
+    :param fn: Path to the CSV file.
+    :param chunk_count: Number of ranges to aim for.
+    :return: (list of column names in the header, list of (start, end) byte offsets in file order)
+    """
+    with open(fn, "rb") as f:
+        data = f.read()
+    size = len(data)
+
+    data_start, quotes = _next_record_start(data, 0, 0)
+    header = next(csv.reader(io.StringIO(data[:data_start].decode("utf-8")), delimiter=",", quotechar='"'), [])
+    if size <= data_start:
+        return header, []
+
+    bounds = [data_start]
+    pos = data_start
+    for i in range(1, chunk_count):
+        target = data_start + (size - data_start) * i // chunk_count
+        if target <= pos:
+            continue
+        quotes += data.count(b'"', pos, target)
+        pos, quotes = _next_record_start(data, target, quotes)
+        if pos >= size:
+            break
+        bounds.append(pos)
+    bounds.append(size)
+    return header, list(zip(bounds[:-1], bounds[1:]))
+
+
+def project_records(reader, header, column_names):
+    """
+    Pull the wanted columns out of parsed CSV records. The column positions are resolved from the header once,
+    so no per-record dict is built.
+    :param reader: Iterator over records, each a list of strings, e.g. a csv.reader positioned after the header.
+    :param header: List of column names in the file.
+    :param column_names: Columns to keep.
+    :return: Iterator over tuples holding the values of column_names, in order. Blank lines are skipped, and
+        missing trailing fields are None, as with csv.DictReader.
+    """
+    positions = [header.index(c) if c in header else None for c in column_names]
+    if None in positions:
+        raise KeyError(column_names[positions.index(None)])
+    if not positions:
+        return (() for rec in reader if rec)
+    width = max(positions) + 1
+    if len(positions) == 1:
+        p = positions[0]
+        get_values = lambda rec: (rec[p],)
+    else:
+        get_values = operator.itemgetter(*positions)
+
+    def records():
+        for rec in reader:
+            if len(rec) < width:
+                if not rec:
+                    continue
+                rec = rec + [None] * (width - len(rec))
+            yield get_values(rec)
+    return records()
+
+
+def parse_number(v):
+    """
+    :param v: A number, or a string holding a number.
+    :return: The number as an int if it is a whole number, e.g. "166" or 166.0, and as a float otherwise. Raises
+        ValueError or TypeError if v is not a number.
+    """
+    x = float(v)
+    return int(x) if x.is_integer() else x
+
+
+def _to_number(column_name):
+    def convert(v):
+        if v is None or v == "":
+            return None
+        try:
+            return parse_number(v)
+        except ValueError:
+            raise ValueError("Invalid value for number column " + column_name + " = " + v)
+    return convert
+
+
+def _not_null(column_name, convert=None):
+    def check(v):
+        if convert is not None:
+            v = convert(v)
+        if v is None or v == "":
+            raise ValueError("Missing value for NOT NULL column = " + column_name)
+        return v
+    return check
+
+
+def coerce_records(records, column_names, number_columns=(), not_null_columns=()):
+    """
+    Convert the values of "number" columns and check NOT NULL columns, in one pass over the records.
+    :param records: Iterator over tuples holding the values of column_names, e.g. from project_records().
+    :param column_names: Column names, in the order of the values.
+    :param number_columns: Columns whose values are converted to numbers, see parse_number(). Empty values become
+        None (NULL).
+    :param not_null_columns: Columns whose values cannot be empty.
+    :return: Iterator over tuples of converted values. Raises ValueError on a value that is not a number or is
+        missing from a NOT NULL column.
+    """
+    converters = []
+    for c in column_names:
+        convert = _to_number(c) if c in number_columns else None
+        if c in not_null_columns:
+            convert = _not_null(c, convert)
+        converters.append(convert)
+    if not any(converters):
+        return records
+    converters = [(i, convert) for i, convert in enumerate(converters) if convert is not None]
+
+    def records_out():
+        for rec in records:
+            rec = list(rec)
+            for i, convert in converters:
+                rec[i] = convert(rec[i])
+            yield tuple(rec)
+    return records_out()
+
+
+def load_chunk(fn, start, end, header, column_names, number_columns=(), not_null_columns=()):
+    """
+    Parse, project and convert the records in a byte range of a CSV file. Runs in a worker process. The file is
+    decoded as UTF-8, and line endings inside quoted fields are kept, as in CSVTable's serial load.
+    :param fn: Path to the CSV file.
+    :param start: Byte offset of the first record in the range.
+    :param end: Byte offset just past the last record in the range.
+    :param header: List of column names in the file.
+    :param column_names: Columns to keep.
+    :param number_columns: Columns to convert to numbers, see coerce_records().
+    :param not_null_columns: Columns that cannot be empty.
+    :return: List of tuples holding the values of column_names, in file order.
+    """
+    with open(fn, "rb") as f:
+        f.seek(start)
+        text = f.read(end - start).decode("utf-8")
+    reader = csv.reader(io.StringIO(text), delimiter=",", quotechar='"')
+    records = project_records(reader, header, column_names)
+    return list(coerce_records(records, column_names, number_columns, not_null_columns))
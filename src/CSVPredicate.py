@@ -0,0 +1,204 @@
+"""
+Compiled templates. A template such as {"nameLast": "Williams", "nameFirst": "Ted"} is turned into Python
+functions specialized for its columns, e.g.
+
+    def select(rows, v0, v1):
+        return [r for r in rows if r['nameLast'] == v0 and r['nameFirst'] == v1]
+
+The generated code only depends on the template's shape (its column names, in order, and the kind of predicate on
+each), not on its values, so it is compiled once per shape and cached. The values are passed as arguments when the
+compiled template is used.
+
+A template value is either a value to compare for equality, or a range predicate: a dict of operator to value,
+e.g. {"H": {">=": 200}} or {"yearID": {"between": [1990, 2000]}}. The operators are in range_operators. Range
+predicates on "number" columns compare numbers. NULL never matches a range.
+"""
+
+import functools
+
+import DataTableExceptions
+
+# Max number of template shapes to keep compiled code for.
+max_cached_shapes = 1024
+
+range_operators = ("<", "<=", ">", ">=", "between")
+
+
+def is_range(v):
+    """
+    :param v: A template value.
+    :return: True if v is a range predicate.
+    """
+    return isinstance(v, dict)
+
+
+def range_bounds(v):
+    """
+    :param v: A range predicate.
+    :return: (low, low inclusive, high, high inclusive). low or high is None if that side is unbounded.
+    """
+    lo, lo_inclusive, hi, hi_inclusive = None, False, None, False
+    for op, operand in v.items():
+        if op == ">" or op == ">=":
+            lo, lo_inclusive = operand, op == ">="
+        elif op == "<" or op == "<=":
+            hi, hi_inclusive = operand, op == "<="
+        elif op == "between":
+            try:
+                (lo, hi), lo_inclusive, hi_inclusive = operand, True, True
+            except (TypeError, ValueError):
+                raise DataTableExceptions.DataTableException(-2, "between needs a [low, high] pair")
+        else:
+            raise DataTableExceptions.DataTableException(-2, "Invalid range operator = " + str(op))
+    return lo, lo_inclusive, hi, hi_inclusive
+
+
+def map_range(v, f):
+    """
+    :param v: A range predicate.
+    :param f: Function to apply to every operand.
+    :return: A new range predicate with the operands converted.
+    """
+    result = {}
+    for op, operand in v.items():
+        if op == "between":
+            result[op] = [f(x) for x in operand]
+        else:
+            result[op] = f(operand)
+    return result
+
+
+def to_number(v):
+    """
+    Convert a template value compared with a "number" column. Empty values are NULL, None.
+    """
+    if v is None or v == "":
+        return None
+    try:
+        return float(v)
+    except (TypeError, ValueError):
+        raise DataTableExceptions.DataTableException(-2, "Invalid value for number column = " + str(v))
+
+
+class CompiledShape:
+    """
+    The functions generated for one template shape.
+    """
+
+    def __init__(self, shape):
+        """
+        :param shape: Tuple with one entry per template column, either ("=", column) or
+            ("range", column, has low, low inclusive, has high, high inclusive, numeric). The values of numeric
+            columns are numbers or None, which never matches a range.
+        """
+        self.shape = shape
+        arg_count = 0
+
+        # Build the condition as a format string of the row expression, so it can be used on r and on rows[i].
+        conditions = []
+        for entry in shape:
+            column = repr(entry[1]).replace("{", "{{").replace("}", "}}")
+            if entry[0] == "=":
+                conditions.append("{row}[%s] == v%d" % (column, arg_count))
+                arg_count += 1
+                continue
+            _, _, has_lo, lo_inclusive, has_hi, hi_inclusive, numeric = entry
+            value = "{row}[%s]" % column
+            if has_lo:
+                value = "v%d %s %s" % (arg_count, "<=" if lo_inclusive else "<", value)
+                arg_count += 1
+            if has_hi:
+                value = "%s %s v%d" % (value, "<=" if hi_inclusive else "<", arg_count)
+                arg_count += 1
+            if numeric:
+                value = "({row}[%s] is not None and %s)" % (column, value)
+            conditions.append(value)
+        condition = " and ".join(conditions) or "True"
+        args = ", ".join("v%d" % i for i in range(arg_count))
+
+        source = (
+            "def match(r, {args}):\n"
+            "    return {condition}\n"
+            "def select(rows, {args}):\n"
+            "    return [r for r in rows if {condition}]\n"
+            "def select_ids(rows, row_ids, {args}):\n"
+            "    return [i for i in row_ids if {id_condition}]\n"
+            "def iter_ids(rows, row_ids, {args}):\n"
+            "    if row_ids is None:\n"
+            "        return (i for i, r in enumerate(rows) if {condition})\n"
+            "    return (i for i in row_ids if {id_condition})\n"
+        ).format(args=args, condition=condition.format(row="r"), id_condition=condition.format(row="rows[i]"))
+        namespace = {}
+        exec(compile(source, "<template %s>" % ", ".join(str(e[1]) for e in shape), "exec"), namespace)
+        self.match = namespace["match"]
+        self.select = namespace["select"]
+        self.select_ids = namespace["select_ids"]
+        self.iter_ids = namespace["iter_ids"]
+
+
+@functools.lru_cache(maxsize=max_cached_shapes)
+def compile_shape(shape):
+    """
+    :param shape: Template shape, see CompiledShape.
+    :return: CompiledShape for templates with this shape.
+    """
+    return CompiledShape(shape)
+
+
+class CompiledTemplate:
+    """
+    A template bound to its compiled shape.
+    """
+
+    def __init__(self, t, number_columns=()):
+        """
+        :param t: A template.
+        :param number_columns: Columns holding numbers, or None for NULL. Template values for them are converted
+            to numbers.
+        """
+        shape = []
+        values = []
+        for k, v in t.items():
+            numeric = k in number_columns
+            if is_range(v):
+                lo, lo_inclusive, hi, hi_inclusive = range_bounds(v)
+                shape.append(("range", k, lo is not None, lo_inclusive, hi is not None, hi_inclusive, numeric))
+                values.extend(to_number(x) if numeric else x for x in (lo, hi) if x is not None)
+            else:
+                shape.append(("=", k))
+                values.append(to_number(v) if numeric else v)
+        self.shape = compile_shape(tuple(shape))
+        self.values = tuple(values)
+
+    def __call__(self, row):
+        """
+        :return: True if the row matches the template.
+        """
+        return self.shape.match(row, *self.values)
+
+    def select(self, rows):
+        """
+        :return: List of the rows that match the template.
+        """
+        return self.shape.select(rows, *self.values)
+
+    def select_ids(self, rows, row_ids):
+        """
+        :return: List of the row ids in row_ids whose rows match the template.
+        """
+        return self.shape.select_ids(rows, row_ids, *self.values)
+
+    def iter_ids(self, rows, row_ids=None):
+        """
+        :return: Iterator over the row ids in row_ids, or in rows if row_ids is None, whose rows match the template.
+        """
+        return self.shape.iter_ids(rows, row_ids, *self.values)
+
+
+def compile_template(t, number_columns=()):
+    """
+    :param t: A template.
+    :param number_columns: Columns holding numbers, see CompiledTemplate.
+    :return: CompiledTemplate for t. The generated code is shared by every template with the same shape.
+    """
+    return CompiledTemplate(t, number_columns)
@@ -0,0 +1,116 @@
+"""
+Query result cache for CSVTable. Results are kept in least recently used order, and the least recently used results
+are evicted once the cache holds more than its limit of entries or of estimated bytes.
+"""
+
+import collections
+import sys
+
+
+def _freeze(v):
+    if isinstance(v, dict):
+        return tuple(sorted((k, _freeze(x)) for k, x in v.items()))
+    if isinstance(v, (list, tuple)):
+        return tuple(_freeze(x) for x in v)
+    return v
+
+
+def make_key(t, fields, limit, offset, order_by=None):
+    """
+    :return: Cache key for a find_by_template() call. Templates that differ only in the order of their columns
+        have the same key. The order of fields matters, since it is the order of the result's columns. Returns
+        None if the call cannot be cached, e.g. a template value is not hashable.
+    """
+    key = (_freeze(t) if t else None, tuple(fields) if fields is not None else None, limit, offset,
+           _freeze(order_by) if order_by else None)
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+def estimate_size(result):
+    """
+    :param result: A list of dicts, or None.
+    :return: Approximate number of bytes held by the result.
+    """
+    if not result:
+        return sys.getsizeof(result)
+    size = sys.getsizeof(result)
+    for r in result:
+        size += sys.getsizeof(r)
+        for v in r.values():
+            size += sys.getsizeof(v)
+    return size
+
+
+class ResultCache:
+    """
+    A bounded LRU cache of query results, with hit and miss counters.
+    """
+
+    def __init__(self, max_entries=128, max_bytes=None):
+        """
+        :param max_entries: Max number of results to keep.
+        :param max_bytes: Max estimated size of the kept results, or None for no limit. A result larger than this
+            is not cached.
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict() # key -> (result, size)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """
+        :param key: Key from make_key().
+        :return: (True, result) on a hit, or (False, None) on a miss.
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return False, None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return True, entry[0]
+
+    def put(self, key, result):
+        """
+        Add a result, evicting the least recently used results if the cache is over its limits.
+        :param key: Key from make_key().
+        :param result: Result to keep. The caller must not modify it afterwards.
+        :return: None
+        """
+        size = estimate_size(result)
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.bytes -= old[1]
+        self.entries[key] = (result, size)
+        self.bytes += size
+        while len(self.entries) > self.max_entries or (self.max_bytes is not None and self.bytes > self.max_bytes):
+            _, (_, evicted_size) = self.entries.popitem(last=False)
+            self.bytes -= evicted_size
+            self.evictions += 1
+
+    def invalidate(self):
+        """
+        Drop every result, e.g. after the table changes.
+        :return: None
+        """
+        self.entries.clear()
+        self.bytes = 0
+
+    def stats(self):
+        """
+        :return: dict of hits, misses, evictions, current entries and estimated bytes.
+        """
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "entries": len(self.entries), "bytes": self.bytes}
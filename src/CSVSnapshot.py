@@ -0,0 +1,395 @@
+"""
+Binary snapshots of loaded tables. A snapshot is written next to the CSV file and holds the projected table in
+columnar form, so a later load can map it instead of parsing the CSV file. A columnar table reads its values from
+the mapped file as they are used. A table in row storage decodes every value into its row dicts on load.
+
+File layout:
+    magic (8 bytes) | header length (8 bytes, little endian) | JSON header | column data
+
+The column data starts at the first 8 byte boundary after the header, and every section in it is 8 byte
+aligned. Offsets in the header are relative to the start of the column data.
+
+A text column is an int32 code per row, followed by a uint32 byte length per distinct value and the UTF-8 bytes of
+the values. The header lists the codes of NULL values, which are stored as empty strings. A number column is a
+float64 per row.
+
+Index files use the same layout with their own magic, and hold the indexes built for one table:
+    hash index: the keys, a uint32 offset per key into an int32 array of row ids
+    sorted index: the keys and the int32 row ids
+    bitmap index: the keys and one fixed size bitmap per key
+Keys are stored one column at a time, as float64s if every value is a number and as strings otherwise, with the
+positions of the NULLs. Whole numbers are read back as ints, like the values of a number column.
+"""
+
+import array
+import json
+import logging
+import mmap
+import os
+import sys
+import tempfile
+
+import CSVColumnStore
+import CSVIndex
+
+
+magic = b"CSVSNAP1"
+snapshot_version = 2
+
+index_magic = b"CSVINDX1"
+
+logger = logging.getLogger(__name__)
+
+
+def snapshot_path(csv_f):
+    return csv_f + ".snapshot"
+
+
+def snapshot_key(csv_f, column_names, column_types):
+    """
+    The snapshot is only valid for the same file contents and the same catalog column definitions.
+    :param csv_f: Path to the CSV file.
+    :param column_names: List of column names in table order.
+    :param column_types: dict of column name to stored type, "text" or "number".
+    :return: A JSON object identifying the snapshot.
+    """
+    st = os.stat(csv_f)
+    return {
+        "version": snapshot_version,
+        "byteorder": sys.byteorder,
+        "path": os.path.abspath(csv_f),
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+        "columns": [[c, column_types.get(c, "text")] for c in column_names]
+    }
+
+
+def _align(n):
+    return (n + 7) & ~7
+
+
+def _map_file(path, file_magic):
+    """
+    :return: (mmap, JSON header, offset of the data) or None if the file is missing or not of this kind.
+    """
+    try:
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    try:
+        if mm[:8] != file_magic:
+            return None
+        header_len = int.from_bytes(mm[8:16], "little")
+        header = json.loads(mm[16:16 + header_len].decode("utf-8"))
+    except ValueError:
+        return None
+    return mm, header, _align(16 + header_len)
+
+
+def _write_file(path, file_magic, header, sections):
+    """
+    Write a file atomically, replacing any existing one. Each section is written 8 byte aligned.
+    :return: True if the file was written. Failures, e.g. a read-only directory, are logged.
+    """
+    header = json.dumps(header).encode("utf-8")
+    data_start = _align(16 + len(header))
+    try:
+        dir_name = os.path.dirname(os.path.abspath(path))
+        fd, tmp_name = tempfile.mkstemp(dir=dir_name, prefix=".snapshot-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(file_magic)
+                f.write(len(header).to_bytes(8, "little"))
+                f.write(header)
+                f.write(b"\0" * (data_start - 16 - len(header)))
+                for section in sections:
+                    f.write(section)
+                    f.write(b"\0" * (_align(len(section)) - len(section)))
+            os.replace(tmp_name, path)
+        except BaseException:
+            os.unlink(tmp_name)
+            raise
+    except OSError as e:
+        logger.warning("Could not write %s: %s", path, e)
+        return False
+    return True
+
+
+def read_snapshot(csv_f, key):
+    """
+    :param csv_f: Path to the CSV file.
+    :param key: Key from snapshot_key(). The snapshot is ignored unless it was written with the same key.
+    :return: A ColumnStore whose columns are mapped from the snapshot file, or None if there is no valid snapshot.
+    """
+    mapped = _map_file(snapshot_path(csv_f), magic)
+    if mapped is None:
+        return None
+    mm, header, base = mapped
+
+    try:
+        if header["key"] != key:
+            return None
+
+        buf = memoryview(mm)
+        row_count = header["row_count"]
+        columns = {}
+        for c in header["columns"]:
+            start = base + c["data_offset"]
+            if c["type"] == "number":
+                data = buf[start:start + 8 * row_count].cast("d")
+                columns[c["name"]] = CSVColumnStore.NumberColumn(data)
+            else:
+                codes = buf[start:start + 4 * row_count].cast("i")
+                start = base + c["lengths_offset"]
+                lengths = buf[start:start + 4 * c["value_count"]].cast("I")
+                values = []
+                pos = base + c["values_offset"]
+                for n in lengths:
+                    values.append(str(mm[pos:pos + n], "utf-8"))
+                    pos += n
+                for code in c["nulls"]:
+                    values[code] = None
+                columns[c["name"]] = CSVColumnStore.TextColumn(codes, values)
+    except (KeyError, ValueError, TypeError) as e:
+        logger.warning("Ignoring invalid snapshot for %s: %s", csv_f, e)
+        return None
+
+    column_names = [c for c, t in key["columns"]]
+    return CSVColumnStore.ColumnStore(column_names, columns=columns, row_count=row_count)
+
+
+def write_snapshot(csv_f, key, store):
+    """
+    Write a snapshot next to the CSV file. The file is replaced atomically. Failures, e.g. a read-only
+    directory or a value that cannot be encoded, are logged and otherwise ignored.
+    :param csv_f: Path to the CSV file.
+    :param key: Key from snapshot_key().
+    :param store: ColumnStore holding the table, with the column types given in the key.
+    :return: True if the snapshot was written.
+    """
+    try:
+        header_columns, sections = _snapshot_sections(store)
+    except (TypeError, ValueError, AttributeError) as e:
+        logger.warning("Could not write the snapshot of %s: %s", csv_f, e)
+        return False
+    header = {"key": key, "row_count": len(store), "columns": header_columns}
+    return _write_file(snapshot_path(csv_f), magic, header, sections)
+
+
+def _snapshot_sections(store):
+    """
+    :return: (JSON description of each column, list of sections holding the column data)
+    """
+    sections = []
+    header_columns = []
+    offset = 0
+    for c in store.column_names:
+        column = store.get_column(c)
+        if isinstance(column, CSVColumnStore.NumberColumn):
+            data = array.array("d", column.data).tobytes()
+            header_columns.append({"name": c, "type": "number", "data_offset": offset})
+            sections.append(data)
+            offset = _align(offset + len(data))
+        else:
+            codes = array.array("i", column.codes).tobytes()
+            nulls = [code for code, v in enumerate(column.values) if v is None]
+            encoded = [b"" if v is None else v.encode("utf-8") for v in column.values]
+            lengths = array.array("I", [len(v) for v in encoded]).tobytes()
+            values = b"".join(encoded)
+            header_columns.append({"name": c, "type": "text", "value_count": len(encoded), "nulls": nulls,
+                                   "data_offset": offset,
+                                   "lengths_offset": _align(offset + len(codes)),
+                                   "values_offset": _align(offset + len(codes)) + _align(len(lengths))})
+            sections.extend([codes, lengths, values])
+            offset = _align(offset + len(codes)) + _align(len(lengths)) + _align(len(values))
+    return header_columns, sections
+
+
+def index_path(csv_f, t_name):
+    return csv_f + "." + t_name + ".indexes"
+
+
+class _Sections:
+    """
+    Collects the sections of an index file. Each add method returns a JSON description of what it added.
+    """
+
+    def __init__(self):
+        self.sections = []
+        self.offset = 0
+
+    def add_bytes(self, data):
+        offset = self.offset
+        self.sections.append(data)
+        self.offset = _align(offset + len(data))
+        return {"offset": offset, "length": len(data)}
+
+    def add_array(self, typecode, values):
+        data = values if isinstance(values, array.array) else array.array(typecode, values)
+        return self.add_bytes(data.tobytes())
+
+    def add_strings(self, values):
+        encoded = [v.encode("utf-8") for v in values]
+        return {"lengths": self.add_array("I", [len(v) for v in encoded]), "values": self.add_bytes(b"".join(encoded))}
+
+    def add_values(self, values):
+        """
+        Add a column of typed values: numbers, strings and None.
+        """
+        nulls = [i for i, v in enumerate(values) if v is None]
+        if all(isinstance(v, (int, float)) and not isinstance(v, bool) or v is None for v in values):
+            data = self.add_array("d", [NaN if v is None else v for v in values])
+            return {"type": "number", "data": data, "nulls": self.add_array("i", nulls)}
+        if all(isinstance(v, str) or v is None for v in values):
+            data = self.add_strings(["" if v is None else v for v in values])
+            return {"type": "text", "data": data, "nulls": self.add_array("i", nulls)}
+        raise TypeError("Index key values must be numbers or strings")
+
+    def add_keys(self, keys, column_count):
+        """
+        Add index keys, as returned by CSVIndex.key_getter().
+        """
+        keys = list(keys)
+        if column_count == 1:
+            return [self.add_values(keys)]
+        key_columns = list(zip(*keys)) or [()] * column_count
+        return [self.add_values(c) for c in key_columns]
+
+
+NaN = float("nan")
+
+
+def _get_bytes(mm, base, desc):
+    start = base + desc["offset"]
+    return mm[start:start + desc["length"]]
+
+
+def _get_array(mm, base, typecode, desc):
+    result = array.array(typecode)
+    result.frombytes(_get_bytes(mm, base, desc))
+    return result
+
+
+def _get_strings(mm, base, desc):
+    data = _get_bytes(mm, base, desc["values"])
+    values = []
+    pos = 0
+    for n in _get_array(mm, base, "I", desc["lengths"]):
+        values.append(str(data[pos:pos + n], "utf-8"))
+        pos += n
+    return values
+
+
+def _get_values(mm, base, desc):
+    if desc["type"] == "number":
+        values = [int(v) if v.is_integer() else v for v in _get_array(mm, base, "d", desc["data"]).tolist()]
+    else:
+        values = _get_strings(mm, base, desc["data"])
+    for i in _get_array(mm, base, "i", desc["nulls"]):
+        values[i] = None
+    return values
+
+
+def _get_keys(mm, base, descs):
+    key_columns = [_get_values(mm, base, desc) for desc in descs]
+    if len(key_columns) == 1:
+        return key_columns[0]
+    return list(zip(*key_columns))
+
+
+def read_indexes(path, key):
+    """
+    :param path: Path from index_path().
+    :param key: JSON object identifying the data and the index definitions. The file is ignored unless it was
+        written with the same key.
+    :return: (hash indexes, sorted indexes, bitmap indexes), as held by CSVTable, or None if there is no valid file.
+    """
+    mapped = _map_file(path, index_magic)
+    if mapped is None:
+        return None
+    mm, header, base = mapped
+
+    indexed_tables = {}
+    sorted_indexes = {}
+    bitmap_indexes = {}
+    try:
+        if header["key"] != key:
+            return None
+        for desc in header["indexes"]:
+            name = desc["name"]
+            if desc["kind"] == "hash":
+                index = CSVIndex.HashIndex(desc["columns"])
+                keys = _get_keys(mm, base, desc["keys"])
+                offsets = _get_array(mm, base, "I", desc["offsets"])
+                row_ids = _get_array(mm, base, "i", desc["row_ids"])
+                index.table = {k: row_ids[offsets[i]:offsets[i + 1]].tolist() for i, k in enumerate(keys)}
+                indexed_tables[name] = index
+            elif desc["kind"] == "sorted":
+                index = CSVIndex.SortedIndex(desc["columns"])
+                index.numeric = desc["numeric"]
+                # Sorted index keys are always tuples.
+                index.keys = [tuple(k) if len(index.columns) > 1 else (k,)
+                              for k in _get_keys(mm, base, desc["keys"])]
+                index.row_ids = _get_array(mm, base, "i", desc["row_ids"])
+                index.null_row_ids = _get_array(mm, base, "i", desc["null_row_ids"]).tolist()
+                index.distinct_keys = desc["distinct_keys"]
+                sorted_indexes[name] = index
+            else:
+                index = CSVIndex.BitmapIndex(desc["columns"])
+                index.row_count = desc["row_count"]
+                size = (index.row_count + 7) // 8
+                data = _get_bytes(mm, base, desc["bitmaps"])
+                keys = _get_keys(mm, base, desc["keys"])
+                index.bitmaps = {k: int.from_bytes(data[i * size:(i + 1) * size], "little") for i, k in enumerate(keys)}
+                bitmap_indexes[name] = index
+    except (KeyError, ValueError, TypeError) as e:
+        logger.warning("Ignoring invalid index file %s: %s", path, e)
+        return None
+    finally:
+        mm.close()
+    return indexed_tables, sorted_indexes, bitmap_indexes
+
+
+def write_indexes(path, key, indexed_tables, sorted_indexes, bitmap_indexes):
+    """
+    Write the indexes of a table to an index file. The file is replaced atomically. Failures are logged and
+    otherwise ignored.
+    :param path: Path from index_path().
+    :param key: JSON object identifying the data and the index definitions.
+    :return: True if the file was written.
+    """
+    sections = _Sections()
+    header_indexes = []
+    try:
+        for name, index in indexed_tables.items():
+            offsets = [0]
+            row_ids = array.array("i")
+            for ids in index.table.values():
+                row_ids.extend(ids)
+                offsets.append(len(row_ids))
+            header_indexes.append({"name": name, "kind": "hash", "columns": index.columns,
+                                   "keys": sections.add_keys(index.table.keys(), len(index.columns)),
+                                   "offsets": sections.add_array("I", offsets),
+                                   "row_ids": sections.add_array("i", row_ids)})
+        for name, index in sorted_indexes.items():
+            keys = sections.add_keys(index.keys, len(index.columns)) if len(index.columns) > 1 else \
+                sections.add_keys([k[0] for k in index.keys], 1)
+            header_indexes.append({"name": name, "kind": "sorted", "columns": index.columns,
+                                   "numeric": index.numeric, "keys": keys,
+                                   "row_ids": sections.add_array("i", index.row_ids),
+                                   "null_row_ids": sections.add_array("i", index.null_row_ids),
+                                   "distinct_keys": index.distinct_keys})
+        for name, index in bitmap_indexes.items():
+            size = (index.row_count + 7) // 8
+            bitmaps = b"".join(b.to_bytes(size, "little") for b in index.bitmaps.values())
+            header_indexes.append({"name": name, "kind": "bitmap", "columns": index.columns,
+                                   "row_count": index.row_count,
+                                   "keys": sections.add_keys(index.bitmaps.keys(), len(index.columns)),
+                                   "bitmaps": sections.add_bytes(bitmaps)})
+    except TypeError as e:
+        logger.warning("Could not write %s: %s", path, e)
+        return False
+
+    header = {"key": key, "indexes": header_indexes}
+    return _write_file(path, index_magic, header, sections.sections)
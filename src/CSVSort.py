@@ -0,0 +1,139 @@
+"""
+ORDER BY for CSVTable. A limited result keeps only the first offset + limit rows in a bounded heap. A full sort is
+done in memory while the rows fit in max_rows_in_memory, and otherwise as an external merge sort: sorted runs are
+spilled to temporary files and merged as the caller reads the result.
+
+An order is a list of column names or (column name, "ASC" or "DESC") pairs. NULL sorts before every other value in
+ascending order, and after them in descending order.
+"""
+
+import heapq
+import itertools
+import pickle
+import tempfile
+
+# Max number of rows sorted in memory. Larger inputs are sorted in runs of this size that are spilled to disk.
+max_rows_in_memory = 100000
+
+# Number of rows pickled together in a spilled run.
+spill_batch_rows = 1000
+
+
+class _Descending:
+    """
+    Wraps a sort key to reverse its order, for orders that mix ascending and descending columns.
+    """
+
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+
+def parse_order_by(order_by):
+    """
+    :param order_by: A column name, or a list of column names or (column name, "ASC" or "DESC") pairs.
+    :return: List of (column name, descending). Raises ValueError for an invalid direction.
+    """
+    if isinstance(order_by, str):
+        order_by = [order_by]
+    order = []
+    for item in order_by:
+        if isinstance(item, str):
+            order.append((item, False))
+            continue
+        try:
+            column, direction = item
+        except (TypeError, ValueError):
+            raise ValueError("Invalid order by item = " + str(item))
+        direction = str(direction).upper()
+        if direction not in ("ASC", "DESC"):
+            raise ValueError("Invalid order by direction = " + str(direction))
+        order.append((column, direction == "DESC"))
+    return order
+
+
+def sort_key(order):
+    """
+    :param order: List of (column name, descending), from parse_order_by().
+    :return: (key function of a row, reverse). Sorting rows with them gives the order.
+    """
+    columns = [c for c, descending in order]
+    if len(set(descending for c, descending in order)) <= 1:
+        reverse = bool(order) and order[0][1]
+        if len(columns) == 1:
+            c = columns[0]
+            return (lambda r: (r[c] is not None, r[c])), reverse
+        return (lambda r: tuple((r[c] is not None, r[c]) for c in columns)), reverse
+
+    def key(r):
+        return tuple(_Descending((r[c] is not None, r[c])) if descending else (r[c] is not None, r[c])
+                     for c, descending in order)
+    return key, False
+
+
+def _spill(rows):
+    f = tempfile.TemporaryFile()
+    for i in range(0, len(rows), spill_batch_rows):
+        pickle.dump(rows[i:i + spill_batch_rows], f, pickle.HIGHEST_PROTOCOL)
+    f.seek(0)
+    return f
+
+
+def _read_run(f):
+    try:
+        while True:
+            try:
+                batch = pickle.load(f)
+            except EOFError:
+                return
+            yield from batch
+    finally:
+        f.close()
+
+
+def _external_sort(rows, key, reverse, run_rows):
+    runs = []
+    try:
+        while True:
+            run = list(itertools.islice(rows, run_rows))
+            if not run:
+                break
+            run.sort(key=key, reverse=reverse)
+            if not runs and len(run) < run_rows:
+                # Everything fit in memory.
+                yield from run
+                return
+            runs.append(_spill(run))
+            del run
+        yield from heapq.merge(*[_read_run(f) for f in runs], key=key, reverse=reverse)
+    finally:
+        for f in runs:
+            f.close()
+
+
+def order_rows(rows, order, limit=None, offset=None, run_rows=None):
+    """
+    :param rows: Iterable of dicts holding the order columns.
+    :param order: List of (column name, descending), from parse_order_by().
+    :param limit: Max to return, or None for no limit.
+    :param offset: Number of rows to skip.
+    :param run_rows: Max number of rows to sort in memory, or None for max_rows_in_memory.
+    :return: Iterator over the rows in order. Ties keep their input order. Raises KeyError if a row lacks an order
+        column.
+    """
+    key, reverse = sort_key(order)
+    offset = offset or 0
+    if limit is not None:
+        # Top-k. Like sorted()[:k], nsmallest() and nlargest() keep ties in input order.
+        k = offset + limit
+        top = heapq.nlargest(k, rows, key=key) if reverse else heapq.nsmallest(k, rows, key=key)
+        return iter(top[offset:])
+    result = _external_sort(iter(rows), key, reverse, run_rows or max_rows_in_memory)
+    return itertools.islice(result, offset, None) if offset else result
@@ -0,0 +1,143 @@
+"""
+Column statistics, collected by CSVTable.analyze() and kept in the catalog's ColumnStatistics table. They give the
+estimated selectivity, i.e. fraction of a table's rows, of a predicate on a column. Estimates for several columns
+assume that the columns are independent.
+"""
+
+import bisect
+import collections
+
+import CSVLoader
+
+# Defaults for column_statistics().
+histogram_buckets = 10
+most_common_count = 10
+
+# Selectivity of a range predicate on a column without a histogram.
+default_range_selectivity = 1.0 / 3
+
+
+def _to_number(v):
+    try:
+        return CSVLoader.parse_number(v)
+    except (TypeError, ValueError):
+        return None
+
+
+def column_statistics(values, column_type="text", buckets=histogram_buckets, most_common=most_common_count):
+    """
+    :param values: Iterable over the values of a column. None and "" are NULL.
+    :param column_type: Catalog column type. "number" columns also get their min, max and an equi-depth
+        histogram. Their values that are not numbers count as NULL.
+    :param buckets: Number of histogram buckets.
+    :param most_common: Number of most common values to keep.
+    :return: dict of row_count, null_count, distinct_count, min_value, max_value, most_common (list of
+        [value, count], most common first) and histogram (buckets + 1 bucket boundaries, each bucket holding about
+        the same number of rows, or None).
+    """
+    number = column_type == "number"
+    counts = collections.Counter()
+    row_count = 0
+    for v in values:
+        row_count += 1
+        if v is None or v == "":
+            continue
+        if number:
+            v = _to_number(v)
+            if v is None or v != v:
+                continue
+        counts[v] += 1
+
+    non_null = sum(counts.values())
+    result = {
+        "row_count": row_count,
+        "null_count": row_count - non_null,
+        "distinct_count": len(counts),
+        "min_value": None,
+        "max_value": None,
+        "most_common": [[v, c] for v, c in counts.most_common(most_common)],
+        "histogram": None
+    }
+    if number and counts:
+        result["min_value"] = min(counts)
+        result["max_value"] = max(counts)
+        ordered = sorted(counts.elements())
+        result["histogram"] = [ordered[(i * non_null) // buckets] for i in range(buckets)] + [ordered[-1]]
+    return result
+
+
+def equality_selectivity(stats, v, number=False):
+    """
+    :param stats: Statistics of the column, from column_statistics().
+    :param v: Value compared with the column. None or "" selects NULL.
+    :param number: True for a "number" column.
+    :return: Estimated fraction of the rows whose value equals v. The most common values have exact counts. The
+        other values are assumed to share the remaining rows equally.
+    """
+    row_count = stats["row_count"]
+    if not row_count:
+        return 0.0
+    if v is None or v == "":
+        return stats["null_count"] / row_count
+    if number:
+        v = _to_number(v)
+    common_rows = 0
+    for value, count in stats["most_common"]:
+        if value == v:
+            return count / row_count
+        common_rows += count
+    other_rows = row_count - stats["null_count"] - common_rows
+    other_values = stats["distinct_count"] - len(stats["most_common"])
+    if other_rows <= 0 or other_values <= 0:
+        return 0.0
+    return other_rows / other_values / row_count
+
+
+def _fraction_below(bounds, x):
+    # Fraction of the histogram's rows below x, interpolating linearly within a bucket.
+    if x <= bounds[0]:
+        return 0.0
+    if x >= bounds[-1]:
+        return 1.0
+    i = bisect.bisect_right(bounds, x) - 1
+    lo, hi = bounds[i], bounds[i + 1]
+    within = (x - lo) / (hi - lo) if hi > lo else 1.0
+    return (i + within) / (len(bounds) - 1)
+
+
+def range_selectivity(stats, lo=None, hi=None):
+    """
+    :param stats: Statistics of a "number" column, from column_statistics().
+    :param lo: Low bound, or None if unbounded.
+    :param hi: High bound, or None if unbounded.
+    :return: Estimated fraction of the rows whose value is between lo and hi. NULL is never in a range.
+    """
+    row_count = stats["row_count"]
+    bounds = stats["histogram"]
+    if not row_count:
+        return 0.0
+    if not bounds:
+        return default_range_selectivity
+    lo = _to_number(lo) if lo is not None else None
+    hi = _to_number(hi) if hi is not None else None
+    if lo is not None and lo == hi:
+        return equality_selectivity(stats, lo, True)
+    below_hi = _fraction_below(bounds, hi) if hi is not None else 1.0
+    below_lo = _fraction_below(bounds, lo) if lo is not None else 0.0
+    non_null = 1.0 - stats["null_count"] / row_count
+    return max(below_hi - below_lo, 0.0) * non_null
+
+
+def distinct_keys(statistics, columns):
+    """
+    :param statistics: dict of column name to statistics.
+    :param columns: List of column names.
+    :return: Estimated number of distinct combinations of the columns' values, or None if a column has no
+        statistics.
+    """
+    if not columns or any(c not in statistics for c in columns):
+        return None
+    keys = 1
+    for c in columns:
+        keys *= max(statistics[c]["distinct_count"], 1)
+    return min(keys, max(statistics[columns[0]]["row_count"], 1))
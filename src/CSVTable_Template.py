@@ -1,41 +1,120 @@
 import csv  # Python package for reading and writing CSV files.
+import itertools
+import math
+import operator
+import threading
 
 # You MAY have to modify to match your project's structure.
 import DataTableExceptions
+import CSVAggregate
 import CSVCatalog
+import CSVColumnStore
+import CSVIndex
+import CSVLoader
+import CSVPredicate
+import CSVResultCache
+import CSVSnapshot
+import CSVSort
+import CSVStatistics
 
 
 import json
 
 max_rows_to_print = 10
 
+# Relative costs used by the join planner, in units of one row comparison.
+hash_build_cost = 2
+index_probe_cost = 1
+
+
+def is_null_key(on_fields):
+    """
+    :param on_fields: Join columns.
+    :return: Function of a join key, as returned by operator.itemgetter(*on_fields), that is True if the key has a
+        NULL value. As in SQL, NULL is not equal to anything, so rows with NULL keys never join.
+    """
+    if len(on_fields) == 1:
+        return lambda k: k is None
+    return lambda k: None in k
+
 
 class CSVTable:
-    # Table engine needs to load table definition information.
-    __catalog__ = CSVCatalog.CSVCatalog()
+    # Table engine needs to load table definition information. The catalog is shared by all tables, and is only
+    # connected when the first table is loaded, so importing this module does not touch the database.
+    __catalog__ = None
+    __catalog_lock__ = threading.RLock()
+
+    # Supported values for the storage parameter of the constructor.
+    storage_types = ("rows", "columnar")
 
-    def __init__(self, t_name, load=True):
+    def __init__(self, t_name, load=True, storage="rows", snapshot=False, load_workers=None, index_files=False,
+                 lazy_indexes=False, index_workers=None, cache_entries=0, cache_bytes=None):
         """
         Constructor.
         :param t_name: Name for table.
         :param load: Load data from a CSV file. If load=False, this is a derived table and engine will
             add rows instead of loading from file.
+        :param storage: "rows" keeps a list of dicts. "columnar" keeps one compact array per column, with
+            dictionary encoded text and numeric arrays for "number" columns. Rows are only materialized as
+            dicts when they are returned. In both, the values of "number" columns are converted on load, to ints
+            for whole numbers and to floats otherwise, with None for empty values, and empty values in NOT NULL
+            columns are rejected.
+        :param snapshot: Load from a binary snapshot of the table next to the CSV file if there is a valid one.
+            Otherwise, load the CSV file and write the snapshot for the next load. Columnar storage uses the mapped
+            snapshot directly. Row storage skips parsing the CSV file, but still builds a dict for every row.
+        :param load_workers: If more than 1, parse the CSV file in chunks on a pool of this many processes.
+        :param index_files: Load the indexes from an index file next to the CSV file if there is a valid one.
+            Otherwise, build them and write the file for the next load.
+        :param lazy_indexes: Do not build the indexes on load. Each index is built the first time the access path
+            chosen by find_by_template(), group_by(), order_by() or join() uses it. Ignored when index_files is set,
+            since the file holds every index.
+        :param index_workers: If more than 1, build the indexes in parallel on a pool of this many processes.
+        :param cache_entries: If more than 0, keep the results of up to this many find_by_template() calls in an
+            LRU cache. Hit and miss counts are in result_cache.stats().
+        :param cache_bytes: Max estimated size of the cached results, or None for no limit.
         """
 
+        if storage not in CSVTable.storage_types:
+            raise DataTableExceptions.DataTableException(-2, "Invalid storage type = " + str(storage))
+
         self.__table_name__ = t_name
+        self.__storage__ = storage
 
         # Holds loaded metadata from the catalog. You have to implement  the called methods below.
         self.__description__ = None
         self.__rows__ = None
-        self.indexed_tables = {} # {field string: table}
+        self.__columns__ = None # CSVColumnStore.ColumnStore in columnar storage
+        self.indexed_tables = {} # {index name: CSVIndex.HashIndex}
+        self.sorted_indexes = {} # {index name: CSVIndex.SortedIndex}
+        self.bitmap_indexes = {} # {index name: CSVIndex.BitmapIndex}
+        self.__pending_indexes__ = {} # {index name: (columns, kind)} not built yet
+        self.result_cache = CSVResultCache.ResultCache(cache_entries, cache_bytes) if cache_entries > 0 else None
+        self.__number_columns__ = frozenset()
+        self.__not_null_columns__ = frozenset()
+        self.__statistics__ = None # {column name: statistics} from analyze(), or None if not analyzed
         if load:
             self.__load_info__()  # Load metadata
+            self.__number_columns__ = frozenset(c for c, t in self.__get_column_types__().items() if t == "number")
+            self.__not_null_columns__ = frozenset(c["column_name"] for c in self.__description__["columns"]
+                                                  if c.get("not_null"))
             self.__rows__ = None # list of dicts
-            self.__load__()  # Load rows from the CSV file.
+            if not (snapshot and self.__load_snapshot__()):
+                if storage == "columnar":
+                    self.__columns__ = CSVColumnStore.ColumnStore(self.__get_column_names__(),
+                                                                  self.__get_column_types__())
+                if load_workers is not None and load_workers > 1:
+                    self.__load_parallel__(load_workers)
+                else:
+                    self.__load__()  # Load rows from the CSV file.
+                if snapshot:
+                    self.__save_snapshot__()
 
             # Build indexes defined in the metadata. We do not implement insert(), update() or delete().
             # So we can build indexes on load.
-            self.__build_indexes__()
+            if not (index_files and self.__load_index_file__()):
+                self.__build_indexes__(lazy_indexes and not index_files, index_workers)
+                if index_files:
+                    self.__save_index_file__()
         else:
             self.__file_name__ = "DERIVED"
 
@@ -45,8 +124,21 @@ class CSVTable:
         Loads metadata from catalog and sets __description__ to hold the information.
         :return:
         """
-        table = CSVTable.__catalog__.get_table(self.__table_name__)
-        self.__description__ = table.describe_table()
+        # The catalog's connection is not thread safe, so tables loaded on several threads take turns using it.
+        with CSVTable.__catalog_lock__:
+            table = CSVTable.__get_catalog__().get_table(self.__table_name__)
+            self.__description__ = table.describe_table()
+            self.__statistics__ = table.get_statistics() or None
+
+    @staticmethod
+    def __get_catalog__():
+        """
+        :return: The shared catalog, connected on first use.
+        """
+        with CSVTable.__catalog_lock__:
+            if CSVTable.__catalog__ is None:
+                CSVTable.__catalog__ = CSVCatalog.CSVCatalog()
+            return CSVTable.__catalog__
     
 
     # Load from a file and creates the table and data.
@@ -54,26 +146,132 @@ class CSVTable:
 
         try:
             fn = self.__get_file_name__()
-            with open(fn, "r") as csvfile:
+            # Read the file like the chunks of __load_parallel__(): UTF-8, with the line endings inside quoted
+            # fields kept as they are.
+            with open(fn, "r", newline="", encoding="utf-8") as csvfile:
                 # CSV files can be pretty complex. You can tell from all of the options on the various readers.
                 # The two params here indicate that "," separates columns and anything in between " ... " should parse
                 # as a single string, even if it has things like "," in it.
-                reader = csv.DictReader(csvfile, delimiter=",", quotechar='"')
+                reader = csv.reader(csvfile, delimiter=",", quotechar='"')
 
                 # Get the names of the columns defined for this table from the metadata.
                 column_names = self.__get_column_names__()
+                header = next(reader, [])
+
+                # Only add the defined columns into the in-memory table. The CSV file may contain columns
+                # that are not relevant to the definition. Their positions are looked up in the header once,
+                # and only those fields are taken from each record. "number" columns are converted in the same
+                # pass, so queries never parse them again.
+                records = CSVLoader.project_records(reader, header, column_names)
+                self.__add_values__(column_names, CSVLoader.coerce_records(records, column_names,
+                                                                           self.__number_columns__,
+                                                                           self.__not_null_columns__))
+
+        except IOError as e:
+            raise DataTableExceptions.DataTableException(
+                code=DataTableExceptions.DataTableException.invalid_file,
+                message="Could not read file = " + fn)
+        except KeyError as ke:
+            raise DataTableExceptions.DataTableException(-2, "Invalid field in project")
+        except ValueError as ve:
+            raise DataTableExceptions.DataTableException(-2, str(ve))
 
-                # Loop through each line (well dictionary) in the input file.
-                for r in reader:
-                    # Only add the defined columns into the in-memory table. The CSV file may contain columns
-                    # that are not relevant to the definition.
-                    projected_r = self.project([r], column_names)[0]
-                    self.__add_row__(projected_r)
+    def __load_parallel__(self, workers):
+        """
+        Load the CSV file on a process pool. The file is split into chunks on record boundaries. The chunks are
+        parsed and projected in parallel and added in file order, so row ids are the same as for __load__().
+        :param workers: Number of worker processes.
+        """
+        import concurrent.futures
 
+        fn = self.__get_file_name__()
+        column_names = self.__get_column_names__()
+        try:
+            header, chunks = CSVLoader.split_file(fn, workers)
+            if not chunks:
+                return
+            starts, ends = zip(*chunks)
+            n = len(chunks)
+            with concurrent.futures.ProcessPoolExecutor(max_workers=min(workers, n)) as pool:
+                # map() returns the results in the order of the chunks.
+                for values in pool.map(CSVLoader.load_chunk, [fn] * n, starts, ends, [header] * n, [column_names] * n,
+                                       [self.__number_columns__] * n, [self.__not_null_columns__] * n):
+                    self.__add_values__(column_names, values)
         except IOError as e:
             raise DataTableExceptions.DataTableException(
                 code=DataTableExceptions.DataTableException.invalid_file,
                 message="Could not read file = " + fn)
+        except KeyError as ke:
+            raise DataTableExceptions.DataTableException(-2, "Invalid field in project")
+        except ValueError as ve:
+            raise DataTableExceptions.DataTableException(-2, str(ve))
+
+    def __get_snapshot_key__(self):
+        # The snapshot holds values checked against the NOT NULL columns, so it is only valid for the same ones.
+        key = CSVSnapshot.snapshot_key(self.__get_file_name__(), self.__get_column_names__(),
+                                       self.__get_column_types__())
+        key["not_null"] = sorted(self.__not_null_columns__)
+        return key
+
+    def __load_snapshot__(self):
+        """
+        Load the table from its snapshot file.
+        :return: True if there was a valid snapshot.
+        """
+        try:
+            key = self.__get_snapshot_key__()
+        except OSError:
+            return False
+        store = CSVSnapshot.read_snapshot(self.__get_file_name__(), key)
+        if store is None:
+            return False
+
+        if self.__storage__ == "columnar":
+            self.__columns__ = store
+        else:
+            column_names = store.column_names
+            columns = [store.get_column(c) for c in column_names]
+            self.__rows__ = [dict(zip(column_names, values)) for values in zip(*columns)] or None
+        return True
+
+    def __save_snapshot__(self):
+        key = self.__get_snapshot_key__()
+        if self.__columns__ is not None:
+            store = self.__columns__
+        else:
+            store = CSVColumnStore.ColumnStore(self.__get_column_names__(), self.__get_column_types__())
+            for row in self.__rows__ or []:
+                store.append(row)
+        CSVSnapshot.write_snapshot(self.__get_file_name__(), key, store)
+
+    def __get_index_file_key__(self):
+        # Index keys depend on the stored values, so the file is only valid for the same snapshot key, and for
+        # the same index definitions.
+        key = self.__get_snapshot_key__()
+        indexes = self.__description__["indexes"]
+        key["indexes"] = sorted([name, list(info["columns"]), str(info["kind"]).upper()]
+                                for name, info in indexes.items())
+        return key
+
+    def __load_index_file__(self):
+        """
+        Load the indexes from the table's index file.
+        :return: True if there was a valid index file.
+        """
+        try:
+            key = self.__get_index_file_key__()
+        except OSError:
+            return False
+        indexes = CSVSnapshot.read_indexes(CSVSnapshot.index_path(self.__get_file_name__(), self.__table_name__), key)
+        if indexes is None:
+            return False
+        self.indexed_tables, self.sorted_indexes, self.bitmap_indexes = indexes
+        return True
+
+    def __save_index_file__(self):
+        CSVSnapshot.write_indexes(CSVSnapshot.index_path(self.__get_file_name__(), self.__table_name__),
+                                  self.__get_index_file_key__(),
+                                  self.indexed_tables, self.sorted_indexes, self.bitmap_indexes)
 
     def __get_file_name__(self):
         description = self.__description__
@@ -84,12 +282,21 @@ class CSVTable:
     def __get_column_names__(self):
         column_names = []
         description  = self.__description__
+        if description is None:
+            # Derived table. The columns are whatever the rows hold.
+            return list(self.__rows__[0].keys()) if self.__rows__ else column_names
         column_list = description["columns"]
         for column in column_list:
             column_name = column["column_name"]
             column_names.append(column_name)
         return column_names
 
+    def __get_column_types__(self):
+        column_types = dict()
+        for column in self.__description__["columns"]:
+            column_types[column["column_name"]] = column["column_type"]
+        return column_types
+
     def __str__(self):
         """
         You can do something simple here. The details of the string returned depend on what properties you
@@ -98,54 +305,262 @@ class CSVTable:
         """
         return self.__get_file_name__()
 
-    def __build_indexes__(self):
+    def __build_indexes__(self, lazy=False, workers=None):
+        """
+        Build the indexes defined in the catalog.
+        :param lazy: Only record the index definitions. Each index is built the first time an access path uses it.
+        :param workers: If more than 1, build the indexes in parallel on a pool of this many processes.
+        :return: None
+        """
         description = self.__description__
         indexes = description["indexes"] #is a dict of {"index_name": {INDEX_INFO}}
+        pending = {}
         for index_name, index_info in indexes.items():
-            list_index_columns = index_info["columns"]
-            index_key_string = '_'.join(list_index_columns[i] for i in range(len(list_index_columns)))
-            #CREATE INDEX KEY STRING 
-            #if (DO CHECK ON IF NEED CREATE INDEX) #and BEST INDEX (__GET_ACCESS_PATH__)
-            # CREATE A DICT WITH {index_columns, row_id}
-            if index_key_string not in self.indexed_tables.keys():
-                self.indexed_tables[index_key_string] = dict()
-            for rowID, row in enumerate(self.__rows__):
-                projected_r = []
-                for field in range(0, len(list_index_columns)):  # Make a new row with just the requested columns/fields.
-                    v = row[list_index_columns[field]]
-                    projected_r.append(v)
-                #projected_r = self.project([r], list_index_columns)[0]
-                row_key_string = '_'.join(projected_r[i] for i in range(len(projected_r)))
-                if row_key_string not in self.indexed_tables[index_key_string].keys():
-                    self.indexed_tables[index_key_string][row_key_string] = []
-                self.indexed_tables[index_key_string][row_key_string].append(rowID)
-                #row_dict = self.indexed_tables[index_key_string]
-                #row_list.append(projected_r)
-            """
-            for (ROW IN SELF.__ROWS__):
-                IF INDEX KEY STRING EXISTS IN DICT:
-                    RETRIEVE VALUE LIST
-                    APPEND TO VALUE LIST 
-                    SET VALUE LIST BACK TO DICT
-                ELSE 
-                    CREATE NEW EMPTY VLUE LIST AND APPEND NEW VALUE
-                    SET VALUE LIST BACK TO DICT
-
-            """
-            # CREATE A DICT WITH {index_columns, row_id}
-        #pass
+            pending[index_name] = (list(index_info["columns"]), str(index_info["kind"]).upper())
+        self.__pending_indexes__.update(pending)
+        if not lazy:
+            self.__build_pending_indexes__(pending, workers)
+
+    def __build_pending_indexes__(self, pending, workers=None):
+        """
+        :param pending: dict of index name to (columns, kind) for the indexes to build.
+        :param workers: If more than 1, build the indexes on a pool of this many processes.
+        :return: None
+        """
+        if workers is not None and workers > 1 and len(pending) > 1:
+            import concurrent.futures
+            all_rows = range(self.__row_count__())
+            with concurrent.futures.ProcessPoolExecutor(max_workers=min(workers, len(pending))) as pool:
+                futures = {}
+                for index_name, (columns, kind) in pending.items():
+                    futures[index_name] = pool.submit(CSVIndex.build_index_columns, kind, columns,
+                                                      self.__number_columns__, self.__take_columns__(columns, all_rows))
+                for index_name, future in futures.items():
+                    self.__add_index__(index_name, pending[index_name][1], future.result())
+        else:
+            for index_name, (columns, kind) in pending.items():
+                index = CSVIndex.build_index(kind, columns, self.__number_columns__,
+                                             self.__iter_column_values__(columns))
+                self.__add_index__(index_name, kind, index)
+        for index_name in pending:
+            self.__pending_indexes__.pop(index_name, None)
+
+    def __add_index__(self, index_name, kind, index):
+        if kind == "SORTED":
+            # Sorted indexes support range predicates. They are not used for hash lookups.
+            self.sorted_indexes[index_name] = index
+        elif kind == "BITMAP":
+            # Bitmap indexes are for columns with few distinct values, and are combined with each other.
+            self.bitmap_indexes[index_name] = index
+        else:
+            self.indexed_tables[index_name] = index
+
+    def __get_index_columns__(self, kind):
+        """
+        Access paths are chosen from the index definitions, so that with lazy indexes only the chosen indexes
+        are built.
+        :param kind: "SORTED", "BITMAP", or any other kind for the hash indexes.
+        :return: dict of index name to columns for the built and pending indexes of that kind.
+        """
+        if kind == "SORTED":
+            built = self.sorted_indexes
+        elif kind == "BITMAP":
+            built = self.bitmap_indexes
+        else:
+            built = self.indexed_tables
+        result = {index_name: index.columns for index_name, index in built.items()}
+        for index_name, (columns, pending_kind) in self.__pending_indexes__.items():
+            if pending_kind == kind or (built is self.indexed_tables and pending_kind not in ("SORTED", "BITMAP")):
+                result[index_name] = columns
+        return result
+
+    def __require_index__(self, index_name):
+        """
+        With lazy indexes, build an index that an access path uses if it is not built yet.
+        :param index_name: Index name.
+        :return: None
+        """
+        if index_name in self.__pending_indexes__:
+            self.__build_pending_indexes__({index_name: self.__pending_indexes__[index_name]})
+
+    def __iter_column_values__(self, fields, row_ids=None):
+        """
+        :param fields: List of column names.
+        :param row_ids: Iterable of the row ids to read, or None for all rows.
+        :return: Iterator over the rows in row id order, yielding a list of the values of fields for each row.
+        """
+        if self.__columns__ is not None:
+            columns = [self.__columns__.get_column(f) for f in fields]
+            if row_ids is None:
+                return map(list, zip(*columns))
+            return ([c[i] for c in columns] for i in row_ids)
+        rows = self.__rows__ or []
+        if row_ids is not None:
+            rows = map(rows.__getitem__, row_ids)
+        return ([row[f] for f in fields] for row in rows)
+
+    def __take_columns__(self, fields, row_ids):
+        """
+        Copy the values of some rows column by column, to send them to a worker process.
+        :param fields: List of column names.
+        :param row_ids: A range or list of row ids.
+        :return: List with the values of each field for the rows. Columnar storage copies slices of its arrays.
+            Row storage has no compact columns, so it copies the values into a list per field.
+        """
+        if self.__columns__ is not None:
+            return self.__columns__.take(fields, row_ids)
+        rows = self.__rows__ or []
+        if isinstance(row_ids, range) and row_ids.step == 1:
+            rows = rows[row_ids.start:row_ids.stop]
+        else:
+            rows = [rows[i] for i in row_ids]
+        return [[row[f] for row in rows] for f in fields]
+
+    def __row_count__(self):
+        if self.__columns__ is not None:
+            return len(self.__columns__)
+        return len(self.__rows__ or [])
+
+    def __get_rows__(self, row_ids, fields=None):
+        """
+        Materialize rows by row id.
+        :param row_ids: Iterable of row ids.
+        :param fields: Columns to include, or None for all.
+        :return: List of dicts.
+        """
+        if self.__columns__ is not None:
+            return self.__columns__.rows(row_ids, fields)
+        rows = self.__rows__
+        return self.project([rows[row_id] for row_id in row_ids], fields)
+
+    def __filter_row_ids__(self, t, row_ids):
+        """
+        :param t: A template.
+        :param row_ids: Candidate row ids.
+        :return: List of the candidate row ids whose rows match the template.
+        """
+        if self.__columns__ is not None:
+            return self.__columns__.select(t, row_ids)
+        return CSVPredicate.compile_template(t, self.__number_columns__).select_ids(self.__rows__, row_ids)
+
+    def __coerce_template__(self, t):
+        """
+        "number" columns hold numbers. Convert the template values for those columns so that templates written
+        with strings, e.g. {"H": "200"}, still match. Empty values become None, which matches NULL.
+        :param t: A template.
+        :return: The template with converted values.
+        """
+        if not t:
+            return t
+        result = {}
+        for k, v in t.items():
+            if CSVPredicate.is_range(v):
+                if k in self.__number_columns__:
+                    v = CSVPredicate.map_range(v, CSVColumnStore.NumberColumn.coerce)
+            elif k in self.__number_columns__:
+                v = CSVColumnStore.NumberColumn.coerce(v)
+            elif self.__columns__ is not None:
+                v = self.__columns__.get_column(k).coerce(v)
+            result[k] = v
+        return result
+
+    def analyze(self, histogram_buckets=CSVStatistics.histogram_buckets, most_common=CSVStatistics.most_common_count):
+        """
+        Collect the statistics of every column and save them in the catalog, like SQL's ANALYZE. They are used to
+        choose indexes and join algorithms, and are loaded with the table until the next analyze().
+        :param histogram_buckets: Number of buckets of the histograms of "number" columns.
+        :param most_common: Number of most common values to keep for each column.
+        :return: dict of column name to statistics, see CSVStatistics.column_statistics().
+        """
+        column_types = self.__get_column_types__() if self.__description__ is not None else {}
+        statistics = {}
+        for c in self.__get_column_names__():
+            values = (v[0] for v in self.__iter_column_values__([c]))
+            statistics[c] = CSVStatistics.column_statistics(values, column_types.get(c, "text"), histogram_buckets,
+                                                            most_common)
+        if self.__description__ is not None:
+            with CSVTable.__catalog_lock__:
+                CSVTable.__get_catalog__().get_table(self.__table_name__).save_statistics(statistics)
+        self.__statistics__ = statistics
+        return statistics
+
+    def __estimate_selectivity__(self, t):
+        """
+        :param t: A template.
+        :return: Estimated fraction of the rows matching the template, or None if a column in the template has no
+            statistics.
+        """
+        if not self.__statistics__:
+            return None
+        selectivity = 1.0
+        for k, v in t.items():
+            stats = self.__statistics__.get(k)
+            if stats is None:
+                return None
+            if not CSVPredicate.is_range(v):
+                selectivity *= CSVStatistics.equality_selectivity(stats, v, k in self.__number_columns__)
+            elif k in self.__number_columns__:
+                lo, _, hi, _ = CSVPredicate.range_bounds(v)
+                selectivity *= CSVStatistics.range_selectivity(stats, lo, hi)
+            else:
+                selectivity *= CSVStatistics.default_range_selectivity
+        return selectivity
 
     def __get_access_path__(self, tmp):
         """
         Returns best index matching the set of keys in the template.
-        Best is defined as the most selective index, i.e. the one with the most distinct index entries.
-        An index name is of the form "colname1_colname2_coluname3" The index matches if the
-        template references the columns in the index name. The template may have additional columns, but must contain
-        all of the columns in the index definition.
+        Best is defined as the most selective index. With statistics from analyze(), this is the index whose lookup
+        is estimated to return the fewest rows for the template's values. Otherwise, it is the one with the most
+        distinct index entries. An index that is not built yet is assumed to be on a key, like the join planner
+        does, and is not built here.
+        The index matches if the template references the columns in the index definition. The template may have
+        additional columns, but must contain all of the columns in the index definition.
         :param tmp: Query template.
         :return: Index or None
         """
-        pass
+        if not tmp:
+            return None
+
+        # Hash indexes only support equality, so only equality predicates can be answered by an index.
+        equality_fields = set(k for k, v in tmp.items() if not CSVPredicate.is_range(v))
+        best_index = None
+        best_selectivity = None
+        for index, columns in self.__get_index_columns__("INDEX").items():
+            if not equality_fields.issuperset(columns):
+                continue
+            selectivity = self.__estimate_selectivity__({c: tmp[c] for c in columns})
+            if selectivity is None:
+                # More distinct keys means fewer rows per key.
+                index_table = self.indexed_tables.get(index)
+                distinct_keys = len(index_table) if index_table is not None else self.__row_count__()
+                selectivity = 1.0 / max(distinct_keys, 1)
+            # Break ties with the wider index.
+            selectivity = (selectivity, -len(columns))
+            if best_selectivity is None or selectivity < best_selectivity:
+                best_index = index
+                best_selectivity = selectivity
+        return best_index
+
+    def __find_index__(self, fields):
+        """
+        Returns the hash index on exactly the given set of columns. With lazy indexes, it may not be built yet.
+        :param fields: List of column names.
+        :return: Index name or None
+        """
+        fields_set = set(fields)
+        for index, columns in self.__get_index_columns__("INDEX").items():
+            if set(columns) == fields_set:
+                return index
+        return None
+
+    def __index_lookup__(self, idx, t):
+        """
+        Probe an index.
+        :param idx: Name of index to use.
+        :param t: A row or template holding a value for every column in the index.
+        :return: List of matching row ids.
+        """
+        return self.indexed_tables[idx].lookup(t)
 
     def matches_template(self, row, t):
         """
@@ -158,15 +573,9 @@ class CSVTable:
         if t is None:
             return True
 
-        try:
-            c_names = list(t.keys())
-            for n in c_names:
-                if row[n] != t[n]:
-                    return False
-            else:
-                return True
-        except Exception as e:
-            raise (e)
+        # Compiled once per template shape. Loops over many rows should compile the template once and use the
+        # CompiledTemplate directly.
+        return CSVPredicate.compile_template(t, self.__number_columns__)(row)
 
     def project(self, rows, fields):
         """
@@ -193,35 +602,59 @@ class CSVTable:
             # happens if the requested field not in rows.
             raise DataTableExceptions.DataTableException(-2, "Invalid field in project")
 
+    def __invalidate_cache__(self):
+        # Any change to the rows makes the cached results stale.
+        if self.result_cache is not None:
+            self.result_cache.invalidate()
+
     def __add_row__(self, projected_row):
+        self.__invalidate_cache__()
+        if self.__columns__ is not None:
+            self.__columns__.append(projected_row)
+            return
         if not self.__rows__:
             self.__rows__ = []
         self.__rows__.append(projected_row)
 
 
+    def __add_values__(self, column_names, values):
+        """
+        Add rows given as sequences of values.
+        :param column_names: Column names, in the table's column order.
+        :param values: Iterable of sequences, each holding the values of column_names for one row.
+        """
+        self.__invalidate_cache__()
+        if self.__columns__ is not None:
+            for v in values:
+                self.__columns__.append_values(v)
+            return
+        rows = [dict(zip(column_names, v)) for v in values]
+        if rows:
+            if not self.__rows__:
+                self.__rows__ = []
+            self.__rows__.extend(rows)
+
     def __find_by_template_scan__(self, t, fields=None, limit=None, offset=None):
         """
         Returns a new, derived table containing rows that match the template and the requested fields if any.
         Returns all row if template is None and all columns if fields is None.
         :param t: The template representing a select predicate.
         :param fields: The list of fields (project fields)
-        :param limit: Max to return. Not implemented
-        :param offset: Offset into the result. Not implemented.
+        :param limit: Max to return.
+        :param offset: Offset into the result.
         :return: New table containing the result of the select and project.
         """
 
         if limit is not None or offset is not None:
-            raise DataTableExceptions.DataTableException(-101, "Limit/offset not supported for CSVTable")
+            row_ids = self.__slice_rows__(self.__iter_row_ids__(t), limit, offset)
+            return list(self.__iter_rows__(row_ids, fields))
 
         # If there are rows and the template is not None
         if self.__rows__ is not None:
 
-            result = []
-
-            # Add the rows that match the template to the newly created table.
-            for r in self.__rows__:
-                if self.matches_template(r, t):
-                    result.append(r)
+            # Add the rows that match the template to the newly created table. The template is compiled into a
+            # scan specialized for its columns.
+            result = CSVPredicate.compile_template(t, self.__number_columns__).select(self.__rows__)
 
             result = self.project(result, fields)
         else:
@@ -229,52 +662,342 @@ class CSVTable:
 
         return result
 
-    def __find_by_template_index__(self, t, idx, fields=None, limit=None, offset=None):
+    def __find_by_template_index__(self, t, list_valid_rows, fields=None, limit=None, offset=None):
         """
-        Find using a selected index
+        Find using the indexes
         :param t: Template representing a where clause/
-        :param idx: Name of index to use.
+        :param list_valid_rows: Candidate row ids from __find_index_rows__().
         :param fields: Fields to return.
-        :param limit: Not implemented. Ignore.
-        :param offset: Not implemented. Ignore
+        :param limit: Max to return.
+        :param offset: Offset into the result.
         :return: Matching tuples.
         """
-        results = []
-        index_fields_list = idx.split("_")
-        template_list = []
-        for field in index_fields_list:
-            template_list.append(t[field])
-        row_key = '_'.join(template_list[i] for i in range(len(template_list)))
-        list_valid_rows = self.indexed_tables[idx][row_key]
-        for row_num in list_valid_rows:
-            row = self.__rows__[row_num]
-            if self.matches_template(row, t):
-                results.append(row)
-        results = self.project(results, fields)
-        return results
-
-    def find_by_template(self, t, fields=None, limit=None, offset=None):
+        if limit is not None or offset is not None:
+            row_ids = self.__slice_rows__(self.__iter_row_ids__(t, list_valid_rows), limit, offset)
+            return list(self.__iter_rows__(row_ids, fields))
+        list_valid_rows = self.__filter_row_ids__(t, list_valid_rows)
+        return self.__get_rows__(list_valid_rows, fields)
+
+    def __find_sorted_index__(self, t):
+        """
+        :param t: A template.
+        :return: Name of a sorted index whose first column is in the template, or None. Indexes whose first column
+            has a range predicate are preferred, since a hash index can handle equality.
+        """
+        valid_index = None
+        for index, columns in self.__get_index_columns__("SORTED").items():
+            first = columns[0]
+            if first in t:
+                if CSVPredicate.is_range(t[first]):
+                    return index
+                if valid_index is None:
+                    valid_index = index
+        return valid_index
+
+    def __find_index_rows__(self, t):
+        """
+        Use the indexes to narrow down the rows a template can match. The best hash index from
+        __get_access_path__(), or a sorted index if statistics show it is more selective, gives the candidate rows.
+        The bitmaps of every bitmap index covered by the template are ANDed and applied to the candidates, or
+        enumerated if there are none.
+        :param t: A template.
+        :return: List of candidate row ids, or None if no index applies. The caller applies the full template.
+        """
+        row_ids = None
+        valid_index = self.__get_access_path__(t)
+        sorted_index = self.__find_sorted_index__(t)
+        if valid_index and sorted_index:
+            # Use the sorted index only if statistics show that it returns fewer rows.
+            hash_columns = self.__get_index_columns__("INDEX")[valid_index]
+            sorted_column = self.__get_index_columns__("SORTED")[sorted_index][0]
+            hash_selectivity = self.__estimate_selectivity__({c: t[c] for c in hash_columns})
+            sorted_selectivity = self.__estimate_selectivity__({sorted_column: t[sorted_column]})
+            if hash_selectivity is None or sorted_selectivity is None or hash_selectivity <= sorted_selectivity:
+                sorted_index = None
+            else:
+                valid_index = None
+        if valid_index:
+            self.__require_index__(valid_index)
+            row_ids = self.__index_lookup__(valid_index, t)
+        elif sorted_index:
+            self.__require_index__(sorted_index)
+            row_ids = self.sorted_indexes[sorted_index].find(t)
+
+        equality_fields = set(k for k, v in t.items() if not CSVPredicate.is_range(v))
+        bitmap_index = None
+        bitmap = None
+        for index_name, columns in self.__get_index_columns__("BITMAP").items():
+            if equality_fields.issuperset(columns):
+                self.__require_index__(index_name)
+                index = self.bitmap_indexes[index_name]
+                b = index.lookup(t)
+                bitmap = b if bitmap is None else bitmap & b
+                bitmap_index = index
+        if bitmap is not None:
+            if not bitmap:
+                return []
+            if row_ids is None:
+                row_ids = bitmap_index.row_ids(bitmap)
+            else:
+                row_ids = bitmap_index.filter(bitmap, row_ids)
+        return row_ids
+
+    def find_by_template(self, t, fields=None, limit=None, offset=None, order_by=None):
+        """
+        :param t: The template representing a select predicate, or None for all rows.
+        :param fields: The list of fields to return, or None for all.
+        :param limit: Max to return, or None for no limit.
+        :param offset: Number of matching rows to skip.
+        :param order_by: Column names or (column name, "ASC" or "DESC") pairs to sort the rows by, or None for
+            table order. See find_by_template_iter().
+        :return: List of dicts, one per matching row. With the result cache, the lists and dicts are copies, so
+            callers cannot change the cached result.
+        """
+        key = CSVResultCache.make_key(t, fields, limit, offset, order_by) if self.result_cache is not None else None
+        if key is None:
+            return self.__find_by_template__(t, fields, limit, offset, order_by)
+        hit, result = self.result_cache.get(key)
+        if not hit:
+            result = self.__find_by_template__(t, fields, limit, offset, order_by)
+            self.result_cache.put(key, result)
+        return [dict(r) for r in result] if result is not None else None
+
+    def __find_by_template__(self, t, fields=None, limit=None, offset=None, order_by=None):
         # 1. Validate the template values relative to the defined columns.
         # 2. Determine if there is an applicable index, and call __find_by_template_index__ if one exists.
         # 3. Call __find_by_template_scan__ if not applicable index.
         #looking by namelast
-        valid_index = None
-        valid_index_fields = 0
+        t = self.__coerce_template__(t)
+        if limit is not None or offset is not None or order_by:
+            return list(self.find_by_template_iter(t, fields, limit, offset, order_by))
         if t:
-            template_fields = t.keys()
-            for index in self.indexed_tables:
-                index_fields_set = set(index.split("_"))
-                if template_fields == index_fields_set:
-                    if len(index_fields_set) > valid_index_fields:
-                        valid_index = index
-                        valid_index_fields = len(index_fields_set)
-            if valid_index:
-                result = self.__find_by_template_index__(t, valid_index, fields, limit, offset)
+            row_ids = self.__find_index_rows__(t)
+            if row_ids is not None:
+                result = self.__find_by_template_index__(t, row_ids, fields, limit, offset)
+            elif self.__columns__ is not None:
+                # Scan the column arrays directly. Only the matching rows are materialized.
+                result = self.__get_rows__(self.__columns__.select(t), fields)
             else:
                 result = self.__find_by_template_scan__(t, fields, limit, offset)
             return result
+        elif self.__columns__ is not None:
+            return self.__get_rows__(range(self.__row_count__()), fields)
+        else:
+            return self.project(self.__rows__, fields) if self.__rows__ is not None else None
+
+    def find_by_template_iter(self, t, fields=None, limit=None, offset=None, order_by=None):
+        """
+        Streaming version of find_by_template(). Rows are found and projected one at a time as the caller
+        consumes them, and the scan stops once limit rows have been returned.
+
+        With order_by, a sorted index on exactly the order columns gives the order if the template has no index of
+        its own, and the scan still stops after limit rows. Otherwise, with a limit, only the first offset + limit
+        rows are kept in a heap. Without one, the rows are sorted, spilling sorted runs to temporary files if there
+        are more than CSVSort.max_rows_in_memory.
+        :param t: The template representing a select predicate, or None for all rows.
+        :param fields: The list of fields to return, or None for all.
+        :param limit: Max to return, or None for no limit.
+        :param offset: Number of matching rows to skip.
+        :param order_by: Column names or (column name, "ASC" or "DESC") pairs to sort the rows by, or None for
+            table order. NULL comes first in ascending order. Rows with equal values keep their table order.
+        :return: Iterator over dicts, one per matching row.
+        """
+        t = self.__coerce_template__(t)
+        if order_by:
+            order = self.__parse_order_by__(order_by, self.__get_column_names__())
+            return self.__find_ordered__(t, fields, limit, offset, order)
+        row_ids = None
+        if t:
+            row_ids = self.__iter_row_ids__(t, self.__find_index_rows__(t))
         else:
-            return self.__rows__
+            row_ids = range(self.__row_count__())
+        return self.__iter_rows__(self.__slice_rows__(row_ids, limit, offset), fields)
+
+    def __parse_order_by__(self, order_by, column_names):
+        """
+        :param order_by: Order, see CSVSort.parse_order_by().
+        :param column_names: The columns that can be ordered by.
+        :return: List of (column name, descending).
+        """
+        try:
+            order = CSVSort.parse_order_by(order_by)
+        except ValueError as ve:
+            raise DataTableExceptions.DataTableException(-2, str(ve))
+        for c, descending in order:
+            if c not in column_names:
+                raise DataTableExceptions.DataTableException(-2, "Invalid field in order by = " + str(c))
+        return order
+
+    def __find_ordered__(self, t, fields, limit, offset, order):
+        """
+        find_by_template_iter() with an order.
+        :param t: A coerced template, or None.
+        :param order: List of (column name, descending).
+        :return: Iterator over the matching rows in order.
+        """
+        candidates = self.__find_index_rows__(t) if t else None
+        if not t or candidates is None:
+            ordered_ids = self.__find_sorted_order__(order)
+            if ordered_ids is not None:
+                row_ids = self.__iter_row_ids__(t, ordered_ids) if t else ordered_ids
+                return self.__iter_rows__(self.__slice_rows__(row_ids, limit, offset), fields)
+
+        row_ids = self.__iter_row_ids__(t, candidates) if t else range(self.__row_count__())
+        # The order columns are read even if they are not returned.
+        extra = [c for c, descending in order if c not in fields] if fields is not None else []
+        rows = self.__iter_rows__(row_ids, list(fields) + extra if extra else fields)
+        rows = CSVSort.order_rows(rows, order, limit, offset)
+        return self.project_iter(rows, fields) if extra else rows
+
+    def __find_sorted_order__(self, order):
+        """
+        :param order: List of (column name, descending).
+        :return: Iterator over every row id in the order, from a sorted index on exactly the order columns, or None
+            if no index gives the order. Index entries are sorted by key and then row id, so equal keys keep table
+            order. Rows with a NULL key come first. For an index on several columns, their NULLs are not in key
+            order, so the index is only used if it has none.
+        """
+        if any(descending for c, descending in order):
+            return None
+        columns = [c for c, descending in order]
+        for index_name, index_columns in self.__get_index_columns__("SORTED").items():
+            if list(index_columns) != columns:
+                continue
+            self.__require_index__(index_name)
+            index = self.sorted_indexes[index_name]
+            if len(columns) == 1 or not index.null_row_ids:
+                return itertools.chain(index.null_row_ids, index.row_ids)
+        return None
+
+    def project_iter(self, rows, fields):
+        """
+        Streaming version of project().
+        :param rows: Iterable of rows.
+        :param fields: A list of column names, or None for all.
+        :return: Iterator over the projected rows.
+        """
+        if fields is None:
+            yield from rows
+            return
+        try:
+            for r in rows:
+                yield {f: r[f] for f in fields}
+        except KeyError as ke:
+            raise DataTableExceptions.DataTableException(-2, "Invalid field in project")
+
+    def __iter_row_ids__(self, t, row_ids=None):
+        """
+        :param t: A template.
+        :param row_ids: Candidate row ids, or None for all rows.
+        :return: Iterator over the candidate row ids whose rows match the template, in order.
+        """
+        if self.__columns__ is not None:
+            return self.__columns__.iter_select(t, row_ids)
+        return CSVPredicate.compile_template(t, self.__number_columns__).iter_ids(self.__rows__ or [], row_ids)
+
+    def __iter_rows__(self, row_ids, fields=None):
+        """
+        Streaming version of __get_rows__().
+        """
+        if self.__columns__ is not None:
+            return self.__columns__.iter_rows(row_ids, fields)
+        rows = self.__rows__
+        return self.project_iter((rows[i] for i in row_ids), fields)
+
+    def __slice_rows__(self, rows, limit, offset):
+        offset = offset or 0
+        if limit is None:
+            return itertools.islice(rows, offset, None) if offset else rows
+        return itertools.islice(rows, offset, offset + limit)
+
+    def group_by(self, keys, aggregates, where_template=None, workers=None):
+        """
+        Like SELECT keys, aggregates FROM table WHERE where_template GROUP BY keys. The matching rows are aggregated
+        in one hash aggregation pass, without materializing them. If an index is built on exactly the grouping
+        columns, its entries are the groups, and only the aggregated columns are read.
+        :param keys: List of grouping columns. If empty, all matching rows are one group.
+        :param aggregates: dict of output column name to (function, column), e.g. {"total_H": ("sum", "H")}. The
+            functions are count, sum, min, max and avg. count with column None counts rows. sum and avg need a
+            "number" column. NULL values are skipped.
+        :param where_template: Template selecting the rows to aggregate, or None for all rows.
+        :param workers: If more than 1, aggregate partitions of the rows on a pool of this many processes, and merge
+            their partial results. Each process is sent the columns of its partition, and returns the partial
+            aggregate states of its groups.
+        :return: List of dicts, one per group, holding the grouping columns and the aggregates.
+        """
+        keys = list(keys or [])
+        try:
+            names, fns, columns = CSVAggregate.parse_aggregates(aggregates)
+        except ValueError as ve:
+            raise DataTableExceptions.DataTableException(-2, str(ve))
+        column_names = self.__get_column_names__()
+        for c in keys + columns:
+            if c is not None and c not in column_names:
+                raise DataTableExceptions.DataTableException(-2, "Invalid field = " + str(c))
+        if self.__description__ is not None:
+            for fn, c in zip(fns, columns):
+                if fn in ("sum", "avg") and c not in self.__number_columns__:
+                    raise DataTableExceptions.DataTableException(-2, fn + " needs a number column, not " + c)
+        if not column_names:
+            return CSVAggregate.results(names, fns, keys, {})
+        # count over rows ignores its input, so any column will do.
+        columns = [column_names[0] if c is None else c for c in columns]
+
+        t = self.__coerce_template__(where_template)
+        candidates = self.__find_index_rows__(t) if t else None
+        if keys and (not t or candidates is None):
+            idx = self.__find_index__(keys)
+            if idx is not None:
+                groups = self.__group_by_index__(idx, keys, fns, columns, t)
+                return CSVAggregate.results(names, fns, keys, groups)
+
+        row_ids = self.__iter_row_ids__(t, candidates) if t else None
+        fields = keys + columns
+        if workers is None or workers <= 1:
+            groups = CSVAggregate.aggregate_values(fns, len(keys), self.__iter_column_values__(fields, row_ids))
+            return CSVAggregate.results(names, fns, keys, groups)
+
+        import concurrent.futures
+        row_ids = list(row_ids) if row_ids is not None else range(self.__row_count__())
+        size = max((len(row_ids) + workers - 1) // workers, 1)
+        partitions = [row_ids[i:i + size] for i in range(0, len(row_ids), size)]
+        groups = {}
+        with concurrent.futures.ProcessPoolExecutor(max_workers=min(workers, max(len(partitions), 1))) as pool:
+            futures = [pool.submit(CSVAggregate.aggregate_columns, fns, len(keys),
+                                   self.__take_columns__(fields, partition))
+                       for partition in partitions]
+            for future in futures:
+                CSVAggregate.merge(fns, groups, future.result())
+        return CSVAggregate.results(names, fns, keys, groups)
+
+    def __group_by_index__(self, idx, keys, fns, columns, t):
+        """
+        Aggregate each entry of a hash index on the grouping columns.
+        :param t: Template the rows must also match, or None.
+        :return: dict of group key to aggregate states, see CSVAggregate.aggregate_values().
+        """
+        self.__require_index__(idx)
+        index = self.indexed_tables[idx]
+        # The index key has the index's column order, which can differ from the order of keys.
+        if len(keys) > 1 and list(index.columns) != keys:
+            positions = [list(index.columns).index(k) for k in keys]
+            reorder = operator.itemgetter(*positions)
+        else:
+            reorder = None
+        count_only = all(fn == "count_rows" for fn in fns)
+
+        groups = {}
+        for k, row_ids in index.table.items():
+            if t:
+                row_ids = self.__filter_row_ids__(t, row_ids)
+                if not row_ids:
+                    continue
+            if count_only:
+                state = [len(row_ids)] * len(fns)
+            else:
+                state = CSVAggregate.aggregate_values(fns, 0, self.__iter_column_values__(columns, row_ids))[()]
+            groups[reorder(k) if reorder is not None else k] = state
+        return groups
 
     def insert(self, r):
         raise DataTableExceptions.DataTableException(
@@ -294,7 +1017,7 @@ class CSVTable:
             message="Updated not implemented"
         )
 
-    def join(self, right_r, on_fields, where_template=None, project_fields=None, optimize=False):
+    def join(self, right_r, on_fields, where_template=None, project_fields=None, optimize=False, order_by=None):
         """
         Implements a JOIN on two CSV Tables. Support equi-join only on a list of common
         columns names.
@@ -303,45 +1026,349 @@ class CSVTable:
         :param on_fields: A list of common fields used for the equi-join.
         :param where_template: Select template to apply to the result to determine what to return.
         :param project_fields: List of fields to return from the result.
+        :param optimize: If True, let the join planner choose the join algorithm. See explain_join().
+        :param order_by: Column names or (column name, "ASC" or "DESC") pairs to sort the result by, or None.
         :return: List of dictionary elements, each representing a row.
         """
+        left_r = self #left table
 
-        # If not optimizations are possible, do a simple nested loop join and then apply where_clause and
-        # project clause to result.
-        #
-        # At least two vastly different optimizations are be possible. You should figure out two different optimizations
-        # and implement them.
+        result_rows = list(self.join_iter(right_r, on_fields, where_template, project_fields, optimize,
+                                          order_by=order_by))
+
+        join_result = self.table_from_rows("JOIN:" + left_r.__table_name__ + ":" + right_r.__table_name__, result_rows)
+            #on_template = self.get_on_template
+        return join_result.get_row_list()
+
+    def join_iter(self, right_r, on_fields, where_template=None, project_fields=None, optimize=False,
+                  limit=None, offset=None, order_by=None):
+        """
+        Streaming version of join(). Joined rows are produced as the caller consumes them, and the join stops once
+        limit rows have been returned. Hash joins still build their hash table, and sort-merge and nested loop
+        joins still read their inputs, before the first row is returned.
+        :param limit: Max to return, or None for no limit.
+        :param offset: Number of joined rows to skip.
+        :param order_by: Column names or (column name, "ASC" or "DESC") pairs to sort the joined rows by, or None.
+            They are sorted as in find_by_template_iter(), with a heap for a limit and an external merge sort
+            otherwise.
+        :return: Iterator over dicts, one per joined row.
+        """
+        if order_by:
+            order = self.__parse_order_by__(order_by,
+                                            set(self.__get_column_names__()) | set(right_r.__get_column_names__()))
+            # The order columns are carried through the join even if they are not returned.
+            carried = project_fields
+            if project_fields is not None:
+                carried = list(project_fields) + [c for c, descending in order if c not in project_fields]
+            result_rows = self.join_iter(right_r, on_fields, where_template, carried, optimize)
+            result_rows = CSVSort.order_rows(result_rows, order, limit, offset)
+            if project_fields is not None and len(carried) > len(project_fields):
+                result_rows = self.project_iter(result_rows, project_fields)
+            return result_rows
+
+        # The where_clause is split by the columns each table owns and pushed down to find_by_template() on each
+        # input, so both inputs can use their indexes. Only the join columns and the projected columns are carried
+        # through the join. Without optimize, the join is always a hash join. With optimize=True, the planner picks
+        # the cheapest of nested loop, index nested loop, hash and sort-merge join.
         #
-        left_r = self #left table
+        spec = self.__get_join_spec__(right_r, on_fields, where_template, project_fields)
+        left_rows, n, right_rows, m = self.__get_join_inputs__(right_r, spec)
+        plan = self.__plan_join__(right_r, on_fields, spec, n, m, optimize)
+        result_rows = self.__execute_join_plan__(plan, right_r, on_fields, spec, left_rows, right_rows)
+        result_rows = self.__slice_rows__(result_rows, limit, offset)
 
-        selected_l = self.find_by_template(where_template) #selected left rows
-        # make into table....
-        # selected_l = self.table_from_rows("") 
-        selected_l = self.table_from_rows("LEFTSELECTED", selected_l)
-        left_rows = selected_l.get_row_list()
-        right_rows = right_r.get_row_list()
-        result_rows = []
+        # The merged rows still hold the join columns. Drop them if they were not asked for.
+        if project_fields is not None and spec["merged_fields"] != list(project_fields):
+            result_rows = self.project_iter(result_rows, project_fields)
+        return result_rows
 
-        left_rows_processed = 0
+    def explain_join(self, right_r, on_fields, where_template=None, project_fields=None, optimize=True):
+        """
+        Returns the plan join() would use for the same arguments, without running the join.
+        :return: A JSON object with the chosen algorithm, the pushed down templates and columns, the input sizes and
+            the estimated cost of every algorithm that was considered.
+        """
+        spec = self.__get_join_spec__(right_r, on_fields, where_template, project_fields)
+        left_rows, n, right_rows, m = self.__get_join_inputs__(right_r, spec)
+        return self.__plan_join__(right_r, on_fields, spec, n, m, optimize)
+
+    def __get_join_spec__(self, right_r, on_fields, where_template, project_fields):
+        """
+        Split the where_template and project_fields of a join between the two inputs.
+        A where column owned by both tables goes to both if it is a join column, because the join makes the
+        values equal, and to the left table otherwise. A projected column owned by both tables is taken from the
+        right table, matching the {**left, **right} merge of joined rows.
+        :return: dict with the template and the list of fields (None for all) to use on each input.
+        """
+        left_columns = set(self.__get_column_names__())
+        right_columns = set(right_r.__get_column_names__())
+
+        left_t, right_t = {}, {}
+        for k, v in (where_template or {}).items():
+            if k in left_columns:
+                left_t[k] = v
+                if k in right_columns and k in on_fields:
+                    right_t[k] = v
+            elif k in right_columns:
+                right_t[k] = v
+            else:
+                raise DataTableExceptions.DataTableException(-2, "Invalid field in where template")
+
+        if project_fields is None:
+            left_fields, right_fields, merged_fields = None, None, None
+        else:
+            left_fields, right_fields = list(on_fields), list(on_fields)
+            for f in project_fields:
+                if f in right_columns:
+                    if f not in right_fields:
+                        right_fields.append(f)
+                elif f in left_columns:
+                    if f not in left_fields:
+                        left_fields.append(f)
+                else:
+                    raise DataTableExceptions.DataTableException(-2, "Invalid field in project")
+            merged_fields = left_fields + [f for f in right_fields if f not in left_fields]
+
+        return {
+            "left_template": self.__coerce_template__(left_t) or None,
+            "right_template": right_r.__coerce_template__(right_t) or None,
+            "left_fields": left_fields,
+            "right_fields": right_fields,
+            "merged_fields": merged_fields
+        }
+
+    def __get_join_inputs__(self, right_r, spec):
+        """
+        :return: (left rows, left row count, right rows, right row count). An input without a pushed down template
+            is returned as an iterator, so it is only read if the join algorithm needs it.
+        """
+        left_rows, n = self.__get_join_input__(spec["left_template"], spec["left_fields"])
+        right_rows, m = right_r.__get_join_input__(spec["right_template"], spec["right_fields"])
+        return left_rows, n, right_rows, m
+
+    def __get_join_input__(self, t, fields):
+        if t is None:
+            return self.find_by_template_iter(None, fields), self.__row_count__()
+        rows = self.find_by_template(t, fields) or []
+        return rows, len(rows)
+
+    def __get_distinct_keys__(self, fields):
+        """
+        Number of distinct values of the given columns, read from an index built on exactly those columns, or
+        else estimated from the statistics.
+        :param fields: List of column names.
+        :return: Count of distinct keys or None if no index or statistics cover the columns.
+        """
+        idx = self.__find_index__(fields)
+        if idx is None or idx not in self.indexed_tables:
+            # Do not build a lazy index just to count its keys.
+            return CSVStatistics.distinct_keys(self.__statistics__ or {}, list(fields))
+        return len(self.indexed_tables[idx])
+
+    def __plan_join__(self, right_r, on_fields, spec, n, m, optimize):
+        """
+        Choose a join algorithm using a simple cost model. Costs are in units of row operations (hash, compare or
+        index probe).
+        :param n: Number of left input rows.
+        :param m: Number of right input rows.
+        :return: Plan, see explain_join().
+        """
+
+        # Without an index or statistics, assume the join columns are a key of the input.
+        left_keys = self.__get_distinct_keys__(on_fields)
+        right_keys = right_r.__get_distinct_keys__(on_fields)
+        left_distinct = min(left_keys or max(n, 1), max(n, 1))
+        right_distinct = min(right_keys or max(m, 1), max(m, 1))
+        estimated_rows = n * m / max(left_distinct, right_distinct, 1)
+
+        costs = {}
+        costs["nested_loop"] = n * m + estimated_rows
+        costs["hash"] = hash_build_cost * min(n, m) + max(n, m) + estimated_rows
+        costs["sort_merge"] = n * math.log2(n + 1) + m * math.log2(m + 1) + n + m + estimated_rows
+
+        # The index covers the whole table, so probes may return rows that the pushed down template rejects.
+        # A lazy index is only built if the plan uses it.
+        right_idx = right_r.__find_index__(on_fields)
+        if right_idx is not None:
+            matches = right_r.__row_count__() / max(right_keys or right_r.__row_count__(), 1)
+            costs["index_nested_loop"] = n * (index_probe_cost + matches) + estimated_rows
+        left_idx = self.__find_index__(on_fields)
+        if left_idx is not None:
+            matches = self.__row_count__() / max(left_keys or self.__row_count__(), 1)
+            costs["index_nested_loop_left"] = m * (index_probe_cost + matches) + estimated_rows
+
+        if optimize:
+            algorithm = min(costs, key=costs.get)
+        else:
+            algorithm = "hash"
+
+        plan = {
+            "algorithm": algorithm,
+            "left_table": self.__table_name__,
+            "right_table": right_r.__table_name__,
+            "on_fields": list(on_fields),
+            "left_template": spec["left_template"],
+            "right_template": spec["right_template"],
+            "left_fields": spec["left_fields"],
+            "right_fields": spec["right_fields"],
+            "left_rows": n,
+            "right_rows": m,
+            "left_distinct_keys": left_distinct,
+            "right_distinct_keys": right_distinct,
+            "estimated_rows": round(estimated_rows),
+            "costs": {k: round(v) for k, v in costs.items()}
+        }
+        if algorithm == "hash":
+            plan["build_side"] = "left" if n < m else "right"
+        elif algorithm == "index_nested_loop":
+            plan["index"] = right_idx
+            plan["index_side"] = "right"
+        elif algorithm == "index_nested_loop_left":
+            # Same algorithm with the roles swapped: stream the right rows and probe the left table's index.
+            plan["algorithm"] = "index_nested_loop"
+            plan["index"] = left_idx
+            plan["index_side"] = "left"
+        return plan
+
+    def __execute_join_plan__(self, plan, right_r, on_fields, spec, left_rows, right_rows):
+        algorithm = plan["algorithm"]
+        if algorithm == "hash":
+            return self.__hash_join__(left_rows, right_rows, on_fields, plan["build_side"] == "left")
+        elif algorithm == "index_nested_loop":
+            if plan["index_side"] == "right":
+                return self.__index_nested_loop_join__(left_rows, right_r, plan["index"],
+                                                       spec["right_template"], spec["right_fields"], True)
+            else:
+                return self.__index_nested_loop_join__(right_rows, self, plan["index"],
+                                                       spec["left_template"], spec["left_fields"], False)
+        elif algorithm == "sort_merge":
+            return self.__sort_merge_join__(left_rows, right_rows, on_fields)
+        else:
+            return self.__nested_loop_join__(left_rows, right_rows, on_fields)
+
+    def __nested_loop_join__(self, left_rows, right_rows, on_fields):
+        """
+        Equi-join two inputs by comparing every left row with every right row.
+        :return: Iterator over joined rows. Right row values win when both rows have a column.
+        """
+        right_rows = list(right_rows)
         for lr in left_rows:
-            #projected_r = self.project([r], column_names)[0]
-            #on_template = self.project(lr, on_fields)
             on_template = self.get_on_template(lr, on_fields)
-            for rr in right_rows:
-                if self.matches_template(rr, on_template):
-                    new_r = {**lr, **rr}
-                    result_rows.append(new_r)
-            left_rows_processed += 1
-            #if left_rows_processed % 10 == 0:
-            #    print("Processed ", left_rows_processed, " left rows ... ")
-            #if left_rows_processed == 200:
-            #    join_result = self.table_from_rows("JOIN:" + left_r.__table_name__ + ":" + right_r.__table_name__, result_rows)
-                #on_template = self.get_on_template
-            #    return join_result.get_row_list()
+            if None in on_template.values():
+                continue
+            for rr in CSVPredicate.compile_template(on_template).select(right_rows):
+                yield {**lr, **rr}
 
-        join_result = self.table_from_rows("JOIN:" + left_r.__table_name__ + ":" + right_r.__table_name__, result_rows)
-            #on_template = self.get_on_template
-        return join_result.get_row_list()
+    def __hash_join__(self, left_rows, right_rows, on_fields, build_left=None):
+        """
+        Equi-join two inputs with a hash join. The hash table is built on one input, keyed on the
+        values of on_fields, and the other input is streamed through it as the probe side.
+        :param left_rows: Rows from the left table.
+        :param right_rows: Rows from the right table.
+        :param on_fields: A list of common fields used for the equi-join.
+        :param build_left: Build the hash table on the left rows. If None, build on the smaller input.
+        :return: Iterator over joined rows. Right row values win when both rows have a column.
+        """
+        # itemgetter returns the value for a single field and a tuple of values for several fields.
+        key_of = operator.itemgetter(*on_fields)
+        is_null = is_null_key(on_fields)
+        if build_left is None:
+            left_rows, right_rows = list(left_rows), list(right_rows)
+            build_left = len(left_rows) < len(right_rows)
+        if build_left:
+            build_rows, probe_rows = left_rows, right_rows
+        else:
+            build_rows, probe_rows = right_rows, left_rows
+
+        hash_table = {}
+        try:
+            for br in build_rows:
+                k = key_of(br)
+                if is_null(k):
+                    continue
+                bucket = hash_table.get(k)
+                if bucket is None:
+                    hash_table[k] = [br]
+                else:
+                    bucket.append(br)
+
+            for pr in probe_rows:
+                # A NULL probe key finds no bucket, since no NULL key was added.
+                bucket = hash_table.get(key_of(pr))
+                if bucket is None:
+                    continue
+                if build_left:
+                    for lr in bucket:
+                        yield {**lr, **pr}
+                else:
+                    for rr in bucket:
+                        yield {**pr, **rr}
+        except KeyError:
+            raise DataTableExceptions.DataTableException(-2, "Invalid field in join")
+
+    def __sort_merge_join__(self, left_rows, right_rows, on_fields):
+        """
+        Equi-join two inputs by sorting both on the join columns and merging them.
+        :return: Iterator over joined rows. Right row values win when both rows have a column.
+        """
+        key_of = operator.itemgetter(*on_fields)
+        is_null = is_null_key(on_fields)
+        try:
+            # NULL keys do not join, and cannot be sorted with numbers.
+            left_sorted = sorted((r for r in left_rows if not is_null(key_of(r))), key=key_of)
+            right_sorted = sorted((r for r in right_rows if not is_null(key_of(r))), key=key_of)
+        except KeyError:
+            raise DataTableExceptions.DataTableException(-2, "Invalid field in join")
+
+        i, j = 0, 0
+        n, m = len(left_sorted), len(right_sorted)
+        while i < n and j < m:
+            lk = key_of(left_sorted[i])
+            rk = key_of(right_sorted[j])
+            if lk < rk:
+                i += 1
+            elif rk < lk:
+                j += 1
+            else:
+                # Find the run of equal keys on both sides and emit their cross product.
+                i_end = i + 1
+                while i_end < n and key_of(left_sorted[i_end]) == lk:
+                    i_end += 1
+                j_end = j + 1
+                while j_end < m and key_of(right_sorted[j_end]) == rk:
+                    j_end += 1
+                for lr in left_sorted[i:i_end]:
+                    for rr in right_sorted[j:j_end]:
+                        yield {**lr, **rr}
+                i, j = i_end, j_end
+
+    def __index_nested_loop_join__(self, outer_rows, inner_table, inner_idx, inner_template, inner_fields,
+                                   inner_is_right):
+        """
+        Equi-join an input with a table by probing an index on the table once per outer row.
+        :param outer_rows: Rows from the other join input.
+        :param inner_table: The table holding the index.
+        :param inner_idx: Name of the index on inner_table whose columns are the join columns.
+        :param inner_template: Template that inner rows must also match, or None.
+        :param inner_fields: Columns to keep from inner rows, or None for all.
+        :param inner_is_right: True if inner_table is the right input of the join.
+        :return: Iterator over joined rows. Right row values win when both rows have a column.
+        """
+        inner_table.__require_index__(inner_idx)
+        on_fields = inner_table.indexed_tables[inner_idx].columns
+        try:
+            for outer in outer_rows:
+                if any(outer[f] is None for f in on_fields):
+                    continue
+                row_ids = inner_table.__index_lookup__(inner_idx, outer)
+                if inner_template is not None:
+                    row_ids = inner_table.__filter_row_ids__(inner_template, row_ids)
+                for inner in inner_table.__get_rows__(row_ids, inner_fields):
+                    if inner_is_right:
+                        yield {**outer, **inner}
+                    else:
+                        yield {**inner, **outer}
+        except KeyError:
+            raise DataTableExceptions.DataTableException(-2, "Invalid field in join")
 
     def table_from_rows(self, table_name, rows):
         table = CSVTable(table_name, False)
@@ -350,6 +1377,8 @@ class CSVTable:
         return table
 
     def get_row_list(self):
+        if self.__columns__ is not None:
+            return self.__get_rows__(range(self.__row_count__()))
         return self.__rows__
 
     def get_on_template(self, row, on_template):
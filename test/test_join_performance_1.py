@@ -1,9 +1,14 @@
 import CSVCatalog
 import CSVTable_Template
 
+import os
+import tempfile
 import time
 import json
 
+# The tests run against an SQLite catalog unless CSV_CATALOG_SQLITE is already set. Set it to "" to use MySQL.
+os.environ.setdefault("CSV_CATALOG_SQLITE", os.path.join(tempfile.gettempdir(), "CSVCatalog_test.db"))
+
 #data_dir = "../Data/core/"
 data_dir = "/Users/irene/"
 
@@ -135,6 +140,8 @@ def test_join_optimizable_2(optimize=False):
     print("Loaded people table = \n", people_tbl)
     print("Loaded batting table = \n", batting_tbl)
 
+    print("Join plan = \n", json.dumps(people_tbl.explain_join(batting_tbl, ['playerID'], optimize=optimize), indent=2))
+
     start_time = time.time()
 
     join_result = people_tbl.join(batting_tbl,['playerID'], None, None, optimize=optimize)
@@ -1,8 +1,14 @@
 import CSVCatalog
+import CSVCatalogBackend
 
+import os
+import tempfile
 import time
 import json
 
+# The tests run against an SQLite catalog unless CSV_CATALOG_SQLITE is already set. Set it to "" to use MySQL.
+os.environ.setdefault("CSV_CATALOG_SQLITE", os.path.join(tempfile.gettempdir(), "CSVCatalog_test.db"))
+
 def cleanup():
     """
     Deletes previously created information to enable re-running tests.
@@ -138,6 +144,33 @@ def test_create_table_4():
     print("People table", json.dumps(t.describe_table(), indent=2))
     print_test_separator("Complete test_create_table_4")
 
+
+def test_sqlite_backend():
+    """
+    Creates a table in a catalog held in an in-memory SQLite database.
+    :return:
+    """
+    print_test_separator("Starting test_sqlite_backend")
+    cat = CSVCatalog.CSVCatalog(backend=CSVCatalogBackend.SQLiteBackend())
+
+    cds = []
+    cds.append(CSVCatalog.ColumnDefinition("playerID", "text", True))
+    cds.append(CSVCatalog.ColumnDefinition("nameLast", "text", True))
+    cds.append(CSVCatalog.ColumnDefinition("birthYear", "number"))
+
+    t = cat.create_table("people_memory", "/Users/irene/People.csv", cds, ['playerID'],
+                         [("birth_year_idx", ['birthYear'], "SORTED")])
+    t.define_index("name_idx", ['nameLast'])
+    t.define_index("id_idx", ['playerID'], "index")
+    print("People table", json.dumps(cat.get_table("people_memory").describe_table(), indent=2))
+    indexes = cat.get_table("people_memory").describe_table()["indexes"]
+    print("Indexes with the default and a lower case kind = ",
+          [(name, indexes[name]["kind"]) for name in ("name_idx", "id_idx") if name in indexes])
+    print("Not in the default catalog = ", CSVCatalog.CSVCatalog().get_table("people_memory") is None)
+    cat.drop_table("people_memory")
+    print("Dropped = ", cat.get_table("people_memory") is None)
+    print_test_separator("Complete test_sqlite_backend")
+
     
 
 test_create_table_1()
@@ -145,4 +178,4 @@ test_create_table_2_fail()
 test_create_table_3()
 test_create_table_3_fail()
 test_create_table_4()
-
+test_sqlite_backend()
@@ -1,8 +1,13 @@
 import CSVCatalog
 
+import os
+import tempfile
 import time
 import json
 
+# The tests run against an SQLite catalog unless CSV_CATALOG_SQLITE is already set. Set it to "" to use MySQL.
+os.environ.setdefault("CSV_CATALOG_SQLITE", os.path.join(tempfile.gettempdir(), "CSVCatalog_test.db"))
+
 def cleanup():
     """
     Deletes previously created information to enable re-running tests.
@@ -91,16 +96,68 @@ def test_create_table_5():
     cat = CSVCatalog.CSVCatalog()
     t = cat.get_table("batting")
     print("Initial status of table = \n", json.dumps(t.describe_table(), indent=2))
+    other_cat = CSVCatalog.CSVCatalog()
+    other_t = other_cat.get_table("batting")
 
     t.add_column_definition(CSVCatalog.ColumnDefinition("HR", "number"))
     t.add_column_definition(CSVCatalog.ColumnDefinition("G", "number"))
     t.define_index("team_year_idx", ['teamID', 'yearID'], "INDEX")
     print("Modified status of table = \n", json.dumps(t.describe_table(), indent=2))
+    print("Reloaded after change = ", cat.get_table("batting") is not t)
+    print("Cached on second get = ", cat.get_table("batting") is cat.get_table("batting"))
+    print("Change seen by another catalog = ", other_cat.get_table("batting") is not other_t,
+          ", columns = ", [c["column_name"] for c in other_cat.get_table("batting").describe_table()["columns"]])
+    other_cat.drop_table("batting")
+    print("Drop seen by another catalog = ", cat.get_table("batting") is None)
     print_test_separator("Success test_create_table_5")
 
+def test_create_table_6():
+    """
+    Creates a table, its primary key and its indexes in one transaction.
+    :return:
+    """
+    print_test_separator("Starting test_create_table_6")
+    cleanup()
+    cat = CSVCatalog.CSVCatalog()
+
+    cds = []
+    cds.append(CSVCatalog.ColumnDefinition("playerID", "text", True))
+    cds.append(CSVCatalog.ColumnDefinition("teamID", "text", True))
+    cds.append(CSVCatalog.ColumnDefinition("yearID", column_type="text", not_null=True))
+    cds.append(CSVCatalog.ColumnDefinition("stint", column_type="number", not_null=True))
+    cds.append(CSVCatalog.ColumnDefinition("H", column_type="number", not_null=False))
+
+    t = cat.create_table("batting", "/Users/irene/Batting.csv", cds,
+                         ['playerID', 'teamID', 'yearID', 'stint'],
+                         [("team_year_idx", ['teamID', 'yearID'], "INDEX"), ("h_idx", ['H'], "SORTED")])
+    print("Batting table", json.dumps(t.describe_table(), indent=2))
+
+    try:
+        cat.create_table("batting_bad", "/Users/irene/Batting.csv", cds, None,
+                         [("team_idx", ['teamID'], "SORTED")])
+    except Exception as e:
+        print("Create failed with e = ", e)
+    print("Failed create was rolled back = ", cat.get_table("batting_bad") is None)
+
+    try:
+        cat.create_table("batting_dup", "/Users/irene/Batting.csv", cds, None,
+                         [("team_year_idx", ['teamID', 'yearID'], "INDEX")])
+    except Exception as e:
+        print("Create with a taken index name failed with e = ", e)
+    print("Create with a taken index name was rolled back = ", cat.get_table("batting_dup") is None)
+
+    try:
+        cat.create_table("batting", "/Users/irene/Batting.csv", cds)
+    except Exception as e:
+        print("Second create failed with e = ", e)
+    print("Columns after second create = ",
+          [c["column_name"] for c in cat.get_table("batting").describe_table()["columns"]])
+    print_test_separator("Success test_create_table_6")
+
 
 
 
 test_create_table_4_fail()
 test_create_table_5_prep()
-test_create_table_5()
\ No newline at end of file
+test_create_table_5()
+test_create_table_6()
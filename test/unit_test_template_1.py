@@ -1,9 +1,16 @@
 import CSVCatalog
 import CSVTable_Template
 
+import csv
+import os
+import shutil
+import tempfile
 import time
 import json
 
+# The tests run against an SQLite catalog unless CSV_CATALOG_SQLITE is already set. Set it to "" to use MySQL.
+os.environ.setdefault("CSV_CATALOG_SQLITE", os.path.join(tempfile.gettempdir(), "CSVCatalog_test.db"))
+
 def cleanup():
     """
     Deletes previously created information to enable re-running tests.
@@ -70,7 +77,474 @@ def test_find_by_template():
     end_time = time.time()
     print("Elapsed time for ", tries, "lookups = ", end_time - start_time)
 
+    tries = 1000
+    start_time = time.time()
+    templ = {"nameLast": "Williams", "nameFirst": "Ted"}
+    print("\n\nStarting test on find using an index on a subset of the fields, tmpl = ", json.dumps(templ))
+    for i in range(0, tries):
+        result = people_tbl.find_by_template(templ, ['playerID', 'nameLast', 'nameFirst'])
+        if i == 0:
+            print("Sample result = ", json.dumps(result))
+    end_time = time.time()
+    print("Elapsed time for ", tries, "lookups = ", end_time - start_time)
+
+    cached_tbl = CSVTable_Template.CSVTable("people", cache_entries=100)
+    tries = 1000
+    start_time = time.time()
+    templ = {"nameFirst": "Ted"}
+    print("\n\nStarting test on find using NON-indexed field with result cache, tmpl = ", json.dumps(templ))
+    for i in range(0, tries):
+        result = cached_tbl.find_by_template(templ, ['playerID', 'nameLast', 'nameFirst'])
+    end_time = time.time()
+    print("Elapsed time for ", tries, "lookups = ", end_time - start_time)
+    print("Cache stats = ", json.dumps(cached_tbl.result_cache.stats()))
+
     print_test_separator("Complete test_finf_by_template")
 
 
+def test_find_by_range():
+
+    cleanup()
+    print_test_separator("Starting test_find_by_range")
+
+    cat = CSVCatalog.CSVCatalog()
+
+    cds = []
+    cds.append(CSVCatalog.ColumnDefinition("playerID", "text", True))
+    cds.append(CSVCatalog.ColumnDefinition("nameLast", "text", True))
+    cds.append(CSVCatalog.ColumnDefinition("nameFirst", column_type="text"))
+    cds.append(CSVCatalog.ColumnDefinition("birthYear", "number"))
+
+    t = cat.create_table(
+        "people", "/Users/irene/People.csv", cds)
+    t.define_index("birth_year_idx", ['birthYear'], "SORTED")
+    print("People table metadata = \n", json.dumps(t.describe_table(), indent=2))
+
+    start_time = time.time()
+    people_tbl = CSVTable_Template.CSVTable("people", lazy_indexes=True)
+    end_time = time.time()
+    print("Elapsed time for load with lazy indexes = ", end_time - start_time)
+
+    tries = 100
+    start_time = time.time()
+    templ = {"birthYear": {"between": [1980, 1981]}, "nameLast": "Williams"}
+    print("Starting test on find using sorted index, tmpl = ", json.dumps(templ))
+    for i in range(0, tries):
+        result = people_tbl.find_by_template(templ, ['playerID', 'nameLast', 'nameFirst', 'birthYear'])
+        if i == 0:
+            print("Sample result = ", json.dumps(result))
+    end_time = time.time()
+    print("Elapsed time for ", tries, "lookups = ", end_time - start_time)
+
+    templ = {"birthYear": "1918", "nameLast": "Williams"}
+    result = people_tbl.find_by_template(templ, ['playerID', 'nameLast', 'nameFirst', 'birthYear'])
+    print("Number column values are loaded as numbers, tmpl = ", json.dumps(templ), " result = ", json.dumps(result))
+    print("Whole numbers are ints = ", all(type(r["birthYear"]) is int for r in result))
+
+    statistics = people_tbl.analyze()
+    print("birthYear statistics = ", json.dumps(statistics["birthYear"]))
+    print("Selectivity of birth_year_idx = ", cat.get_table("people").get_index_selectivity("birth_year_idx"))
+
+    print_test_separator("Complete test_find_by_range")
+
+
+def test_find_by_bitmap():
+
+    cleanup()
+    print_test_separator("Starting test_find_by_bitmap")
+
+    cat = CSVCatalog.CSVCatalog()
+
+    cds = []
+    cds.append(CSVCatalog.ColumnDefinition("playerID", "text", True))
+    cds.append(CSVCatalog.ColumnDefinition("nameLast", "text", True))
+    cds.append(CSVCatalog.ColumnDefinition("birthCountry", "text"))
+    cds.append(CSVCatalog.ColumnDefinition("throws", column_type="text"))
+    cds.append(CSVCatalog.ColumnDefinition("bats", column_type="text"))
+
+    t = cat.create_table(
+        "people", "/Users/irene/People.csv", cds)
+    t.define_index("throws_idx", ['throws'], "BITMAP")
+    t.define_index("bats_idx", ['bats'], "BITMAP")
+    t.define_index("country_idx", ['birthCountry'], "BITMAP")
+    print("People table metadata = \n", json.dumps(t.describe_table(), indent=2))
+
+    for i in range(0, 2):
+        start_time = time.time()
+        people_tbl = CSVTable_Template.CSVTable("people", index_files=True)
+        end_time = time.time()
+        print("Elapsed time for load ", i, "with index file = ", end_time - start_time)
+
+    tries = 100
+    start_time = time.time()
+    templ = {"throws": "L", "bats": "R", "birthCountry": "USA"}
+    print("Starting test on find using bitmap indexes, tmpl = ", json.dumps(templ))
+    for i in range(0, tries):
+        result = people_tbl.find_by_template(templ, ['playerID', 'nameLast'])
+        if i == 0:
+            print("Sample result count = ", len(result))
+    end_time = time.time()
+    print("Elapsed time for ", tries, "lookups = ", end_time - start_time)
+
+    print_test_separator("Complete test_find_by_bitmap")
+
+
+def test_group_by():
+
+    cleanup()
+    print_test_separator("Starting test_group_by")
+
+    cat = CSVCatalog.CSVCatalog()
+
+    cds = []
+    cds.append(CSVCatalog.ColumnDefinition("playerID", "text", True))
+    cds.append(CSVCatalog.ColumnDefinition("birthCountry", "text"))
+    cds.append(CSVCatalog.ColumnDefinition("throws", column_type="text"))
+    cds.append(CSVCatalog.ColumnDefinition("birthYear", "number"))
+
+    t = cat.create_table(
+        "people", "/Users/irene/People.csv", cds)
+    t.define_index("country_idx", ['birthCountry'], "INDEX")
+
+    people_tbl = CSVTable_Template.CSVTable("people")
+    aggregates = {"players": ("count", None), "first_year": ("min", "birthYear"), "avg_year": ("avg", "birthYear")}
+
+    start_time = time.time()
+    result = people_tbl.group_by(['birthCountry'], aggregates)
+    end_time = time.time()
+    print("Groups by indexed birthCountry = ", len(result), ", sample = ", json.dumps(result[:3]))
+    print("Elapsed time = ", end_time - start_time)
+
+    start_time = time.time()
+    result = people_tbl.group_by(['throws'], aggregates, {"birthCountry": "USA"})
+    end_time = time.time()
+    print("Groups by throws where birthCountry = USA = ", json.dumps(result))
+    print("Elapsed time = ", end_time - start_time)
+
+    # Workers are sent the columns of their partition, and the parent merges their partial aggregates.
+    t.define_index("throws_idx", ['throws'], "BITMAP")
+    serial_tbl = CSVTable_Template.CSVTable("people")
+    for storage in ("rows", "columnar"):
+        parallel_tbl = CSVTable_Template.CSVTable("people", storage=storage, index_workers=4)
+        print(storage, "indexes built by workers same as serial = ",
+              parallel_tbl.indexed_tables["country_idx"].table == serial_tbl.indexed_tables["country_idx"].table and
+              parallel_tbl.bitmap_indexes["throws_idx"].bitmaps == serial_tbl.bitmap_indexes["throws_idx"].bitmaps)
+        for templ in (None, {"birthCountry": "USA"}):
+            result = serial_tbl.group_by(['throws', 'birthYear'], aggregates, templ)
+            print(storage, "tmpl = ", json.dumps(templ), ", groups = ", len(result), ", workers same as serial = ",
+                  parallel_tbl.group_by(['throws', 'birthYear'], aggregates, templ, workers=4) == result)
+
+    print_test_separator("Complete test_group_by")
+
+
+def test_order_by():
+
+    cleanup()
+    print_test_separator("Starting test_order_by")
+
+    cat = CSVCatalog.CSVCatalog()
+
+    cds = []
+    cds.append(CSVCatalog.ColumnDefinition("playerID", "text", True))
+    cds.append(CSVCatalog.ColumnDefinition("nameLast", "text", True))
+    cds.append(CSVCatalog.ColumnDefinition("birthCountry", "text"))
+    cds.append(CSVCatalog.ColumnDefinition("birthYear", "number"))
+
+    t = cat.create_table(
+        "people", "/Users/irene/People.csv", cds)
+    t.define_index("birthyear_idx", ['birthYear'], "SORTED")
+
+    people_tbl = CSVTable_Template.CSVTable("people")
+
+    start_time = time.time()
+    result = people_tbl.find_by_template(None, ['playerID', 'birthYear'], limit=5, order_by=['birthYear'])
+    end_time = time.time()
+    print("First 5 by sorted index on birthYear = ", json.dumps(result))
+    print("Elapsed time = ", end_time - start_time)
+
+    start_time = time.time()
+    result = people_tbl.find_by_template({"birthCountry": "USA"}, ['playerID', 'nameLast'], limit=5,
+                                         order_by=[("birthYear", "DESC"), "nameLast"])
+    end_time = time.time()
+    print("Top 5 youngest born in USA = ", json.dumps(result))
+    print("Elapsed time = ", end_time - start_time)
+
+    start_time = time.time()
+    result = people_tbl.find_by_template(None, ['playerID', 'nameLast'], order_by=['nameLast', 'playerID'])
+    end_time = time.time()
+    print("Sorted by nameLast = ", len(result), ", first = ", json.dumps(result[:3]))
+    print("Elapsed time = ", end_time - start_time)
+
+    print_test_separator("Complete test_order_by")
+
+
+def test_columnar_storage():
+
+    cleanup()
+    print_test_separator("Starting test_columnar_storage")
+
+    cat = CSVCatalog.CSVCatalog()
+
+    cds = []
+    cds.append(CSVCatalog.ColumnDefinition("playerID", "text", True))
+    cds.append(CSVCatalog.ColumnDefinition("nameLast", "text", True))
+    cds.append(CSVCatalog.ColumnDefinition("nameFirst", column_type="text"))
+    cds.append(CSVCatalog.ColumnDefinition("birthCountry", "text"))
+    cds.append(CSVCatalog.ColumnDefinition("birthYear", "number"))
+
+    t = cat.create_table(
+        "people", "/Users/irene/People.csv", cds)
+    t.define_index("id_idx", ['nameLast'], "INDEX")
+
+    rows_tbl = CSVTable_Template.CSVTable("people")
+    columnar_tbl = CSVTable_Template.CSVTable("people", storage="columnar")
+
+    for templ, fields in [({"nameLast": "Williams"}, ['playerID', 'nameFirst', 'birthYear']),
+                          ({"nameFirst": "Ted"}, None),
+                          ({"birthCountry": "CAN", "birthYear": {">=": 1980}}, ['playerID']),
+                          ({"nameLast": "Williams"}, [])]:
+        same = rows_tbl.find_by_template(templ, fields) == columnar_tbl.find_by_template(templ, fields)
+        print("Same find result for tmpl = ", json.dumps(templ), ", fields = ", fields, ": ", same)
+
+    fields = ['playerID', 'nameLast']
+    same = rows_tbl.project(rows_tbl.find_by_template({"nameFirst": "Ted"}), fields) == \
+        list(columnar_tbl.project_iter(columnar_tbl.find_by_template_iter({"nameFirst": "Ted"}), fields))
+    print("Same project result = ", same)
+
+    templ = {"nameLast": "Williams"}
+    rows_join = rows_tbl.join(columnar_tbl, ['playerID'], templ, ['playerID', 'nameFirst', 'birthYear'])
+    columnar_join = columnar_tbl.join(rows_tbl, ['playerID'], templ, ['playerID', 'nameFirst', 'birthYear'])
+    print("Same join result = ", rows_join == columnar_join, ", rows = ", len(rows_join))
+
+    print_test_separator("Complete test_columnar_storage")
+
+
+def test_snapshot():
+
+    cleanup()
+    print_test_separator("Starting test_snapshot")
+
+    # The test changes the CSV file, so it works on a copy.
+    data_dir = tempfile.mkdtemp()
+    csv_f = os.path.join(data_dir, "People.csv")
+    shutil.copy("/Users/irene/People.csv", csv_f)
+    snapshot_f = csv_f + ".snapshot"
+
+    cat = CSVCatalog.CSVCatalog()
+
+    cds = []
+    cds.append(CSVCatalog.ColumnDefinition("playerID", "text", True))
+    cds.append(CSVCatalog.ColumnDefinition("nameLast", "text", True))
+    cds.append(CSVCatalog.ColumnDefinition("birthCountry", "text"))
+    cds.append(CSVCatalog.ColumnDefinition("birthYear", "number"))
+
+    cat.create_table("people", csv_f, cds)
+    expected = CSVTable_Template.CSVTable("people").find_by_template(None)
+
+    start_time = time.time()
+    CSVTable_Template.CSVTable("people", snapshot=True)
+    end_time = time.time()
+    print("Snapshot written = ", os.path.exists(snapshot_f), ", elapsed time = ", end_time - start_time)
+    written = os.stat(snapshot_f).st_mtime_ns
+
+    for storage in CSVTable_Template.CSVTable.storage_types:
+        start_time = time.time()
+        people_tbl = CSVTable_Template.CSVTable("people", storage=storage, snapshot=True)
+        end_time = time.time()
+        print("Loaded ", storage, " from snapshot, same rows = ", people_tbl.find_by_template(None) == expected,
+              ", snapshot reused = ", os.stat(snapshot_f).st_mtime_ns == written,
+              ", elapsed time = ", end_time - start_time)
+
+    st = os.stat(csv_f)
+    os.utime(csv_f, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    people_tbl = CSVTable_Template.CSVTable("people", snapshot=True)
+    print("Snapshot rebuilt after the CSV mtime changed = ", os.stat(snapshot_f).st_mtime_ns != written,
+          ", same rows = ", people_tbl.find_by_template(None) == expected)
+    written = os.stat(snapshot_f).st_mtime_ns
+
+    with open(csv_f, "r", newline="") as f:
+        header = next(csv.reader(f))
+    with open(csv_f, "a", newline="") as f:
+        csv.DictWriter(f, header).writerow({"playerID": "snapsh01", "nameLast": "Snapshot", "birthYear": "2000"})
+    people_tbl = CSVTable_Template.CSVTable("people", storage="columnar", snapshot=True)
+    print("Snapshot rebuilt after the CSV size changed = ", os.stat(snapshot_f).st_mtime_ns != written,
+          ", new row = ", json.dumps(people_tbl.find_by_template({"playerID": "snapsh01"})))
+
+    # Records with missing trailing fields hold NULLs in text columns.
+    ragged_f = os.path.join(data_dir, "Ragged.csv")
+    with open(ragged_f, "w", newline="") as f:
+        f.write("playerID,nameLast,birthCountry,birthYear\nragged01,Smith,USA,1980\nragged02,Jones\n"
+                "ragged03,Brown,D.R.\n")
+    cat.create_table("ragged", ragged_f, cds)
+    expected = CSVTable_Template.CSVTable("ragged").find_by_template(None)
+    for storage in CSVTable_Template.CSVTable.storage_types:
+        written = CSVTable_Template.CSVTable("ragged", storage=storage, snapshot=True).find_by_template(None)
+        reused = CSVTable_Template.CSVTable("ragged", storage=storage, snapshot=True).find_by_template(None)
+        print("Ragged CSV in ", storage, " with snapshot, rows = ", json.dumps(reused),
+              ", same rows = ", written == expected and reused == expected)
+    os.remove(ragged_f + ".snapshot")
+    cat.drop_table("ragged")
+
+    shutil.rmtree(data_dir)
+    print_test_separator("Complete test_snapshot")
+
+
+def test_parallel_load():
+
+    cleanup()
+    print_test_separator("Starting test_parallel_load")
+
+    cat = CSVCatalog.CSVCatalog()
+
+    cds = []
+    cds.append(CSVCatalog.ColumnDefinition("playerID", "text", True))
+    cds.append(CSVCatalog.ColumnDefinition("nameLast", "text", True))
+    cds.append(CSVCatalog.ColumnDefinition("birthCity", "text"))
+    cds.append(CSVCatalog.ColumnDefinition("birthYear", "number"))
+
+    cat.create_table("people", "/Users/irene/People.csv", cds)
+
+    for storage in CSVTable_Template.CSVTable.storage_types:
+        start_time = time.time()
+        serial_tbl = CSVTable_Template.CSVTable("people", storage=storage)
+        end_time = time.time()
+        print("Elapsed time for serial ", storage, " load = ", end_time - start_time)
+
+        start_time = time.time()
+        parallel_tbl = CSVTable_Template.CSVTable("people", storage=storage, load_workers=4)
+        end_time = time.time()
+        print("Elapsed time for parallel ", storage, " load = ", end_time - start_time)
+
+        serial_rows = serial_tbl.find_by_template(None)
+        parallel_rows = parallel_tbl.find_by_template(None)
+        print("Same rows in the same order = ", serial_rows == parallel_rows, ", rows = ", len(parallel_rows))
+
+    # A file with CRLF line endings and quoted fields holding line breaks.
+    data_dir = tempfile.mkdtemp()
+    crlf_f = os.path.join(data_dir, "Crlf.csv")
+    with open(crlf_f, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f, lineterminator="\r\n")
+        writer.writerow(["playerID", "nameLast", "birthCity", "birthYear"])
+        for i in range(3000):
+            city = "multi\r\nline crlf" if i % 7 == 0 else ("caf\u00e9, \"quoted\"" if i % 5 == 0 else "plain")
+            writer.writerow(["crlf" + str(i), "Name\n" + str(i) if i % 11 == 0 else "Name", city, 1900 + i % 100])
+    cat.create_table("crlf", crlf_f, cds)
+    for storage in CSVTable_Template.CSVTable.storage_types:
+        serial_rows = CSVTable_Template.CSVTable("crlf", storage=storage).find_by_template(None)
+        for workers in (2, 4):
+            parallel_tbl = CSVTable_Template.CSVTable("crlf", storage=storage, load_workers=workers)
+            parallel_rows = parallel_tbl.find_by_template(None)
+            print("CRLF file in ", storage, " with ", workers, " workers, same rows in the same order = ",
+                  serial_rows == parallel_rows, ", rows = ", len(parallel_rows))
+    cat.drop_table("crlf")
+    shutil.rmtree(data_dir)
+
+    print_test_separator("Complete test_parallel_load")
+
+
+def test_find_iter():
+
+    cleanup()
+    print_test_separator("Starting test_find_iter")
+
+    cat = CSVCatalog.CSVCatalog()
+
+    cds = []
+    cds.append(CSVCatalog.ColumnDefinition("playerID", "text", True))
+    cds.append(CSVCatalog.ColumnDefinition("nameLast", "text", True))
+    cds.append(CSVCatalog.ColumnDefinition("nameFirst", column_type="text"))
+    cds.append(CSVCatalog.ColumnDefinition("throws", column_type="text"))
+    cds.append(CSVCatalog.ColumnDefinition("birthYear", "number"))
+
+    t = cat.create_table(
+        "people", "/Users/irene/People.csv", cds)
+    t.define_index("id_idx", ['nameLast'], "INDEX")
+    t.define_index("throws_idx", ['throws'], "INDEX")
+    t.define_index("birth_year_idx", ['birthYear'], "SORTED")
+
+    people_tbl = CSVTable_Template.CSVTable("people")
+    all_rows = people_tbl.find_by_template(None)
+    fields = ['playerID', 'nameLast', 'birthYear']
+
+    # Statistics change the index used for a template, but not the result.
+    for analyzed in (False, True):
+        if analyzed:
+            people_tbl.analyze()
+        for templ in [{"nameLast": "Williams"}, {"nameFirst": "Ted"},
+                      {"throws": "R", "birthYear": {"between": [1980, 1990]}}]:
+            # The matching rows in table order.
+            expected = people_tbl.project([r for r in all_rows if people_tbl.matches_template(r, templ)], fields)
+            result = people_tbl.find_by_template(templ, fields)
+            print("analyzed = ", analyzed, ", tmpl = ", json.dumps(templ), ", rows = ", len(result),
+                  ", in table order = ", result == expected,
+                  ", iterator same as list = ", list(people_tbl.find_by_template_iter(templ, fields)) == result)
+            page = people_tbl.find_by_template(templ, fields, limit=3, offset=2)
+            print("limit 3 offset 2 = ", json.dumps(page), ", expected rows = ", page == expected[2:5],
+                  ", iterator same as list = ",
+                  list(people_tbl.find_by_template_iter(templ, fields, limit=3, offset=2)) == page)
+
+    join_tbl = CSVTable_Template.CSVTable("people", storage="columnar")
+    templ = {"nameLast": "Williams"}
+    result = people_tbl.join(join_tbl, ['playerID'], templ, ['playerID', 'nameFirst'])
+    print("Join iterator same as list = ",
+          list(people_tbl.join_iter(join_tbl, ['playerID'], templ, ['playerID', 'nameFirst'])) == result)
+    page = list(people_tbl.join_iter(join_tbl, ['playerID'], templ, ['playerID', 'nameFirst'], limit=3, offset=2))
+    print("Join limit 3 offset 2 = ", json.dumps(page), ", expected rows = ", page == result[2:5])
+
+    print_test_separator("Complete test_find_iter")
+
+
+def test_lazy_indexes():
+
+    cleanup()
+    print_test_separator("Starting test_lazy_indexes")
+
+    cat = CSVCatalog.CSVCatalog()
+
+    cds = []
+    cds.append(CSVCatalog.ColumnDefinition("playerID", "text", True))
+    cds.append(CSVCatalog.ColumnDefinition("nameLast", "text", True))
+    cds.append(CSVCatalog.ColumnDefinition("nameFirst", column_type="text"))
+    cds.append(CSVCatalog.ColumnDefinition("birthYear", "number"))
+
+    t = cat.create_table(
+        "people", "/Users/irene/People.csv", cds)
+    t.define_index("id_idx", ['playerID'], "INDEX")
+    t.define_index("last_idx", ['nameLast'], "INDEX")
+    t.define_index("birth_year_idx", ['birthYear'], "SORTED")
+    t.define_index("birth_year_hash_idx", ['birthYear'], "INDEX")
+
+    left_tbl = CSVTable_Template.CSVTable("people", lazy_indexes=True)
+    right_tbl = CSVTable_Template.CSVTable("people", lazy_indexes=True)
+
+    # Only the indexes on the chosen access path are built.
+    left_tbl.join(right_tbl, ['playerID'], None, ['playerID', 'nameLast'])
+    print("Indexes built by a hash join = ", sorted(left_tbl.indexed_tables), sorted(right_tbl.indexed_tables))
+
+    templ = {"birthYear": {"between": [1980, 1981]}}
+    left_tbl.find_by_template(templ)
+    print("Indexes built by tmpl = ", json.dumps(templ), ", hash = ", sorted(left_tbl.indexed_tables),
+          ", sorted = ", sorted(left_tbl.sorted_indexes))
+
+    templ = {"nameLast": "Williams"}
+    left_tbl.find_by_template(templ)
+    print("Indexes built by tmpl = ", json.dumps(templ), ", hash = ", sorted(left_tbl.indexed_tables))
+
+    plan = left_tbl.explain_join(right_tbl, ['playerID'], templ, ['playerID', 'nameLast'])
+    print("Join plan = ", plan["algorithm"], ", indexes built by explain_join = ", sorted(right_tbl.indexed_tables))
+    left_tbl.join(right_tbl, ['playerID'], templ, ['playerID', 'nameLast'], optimize=True)
+    print("Indexes built by the join = ", sorted(right_tbl.indexed_tables))
+
+    print_test_separator("Complete test_lazy_indexes")
+
+
 test_find_by_template()
+test_find_by_range()
+test_find_by_bitmap()
+test_group_by()
+test_order_by()
+test_columnar_storage()
+test_snapshot()
+test_parallel_load()
+test_find_iter()
+test_lazy_indexes()